@@ -4,9 +4,12 @@ import os
 class SystemConfig(BaseModel):
     max_queue_size: int = Field(default=10, ge=1, description="任务队列的最大容量")
     force_cpu: bool = Field(default=False, description="是否强制使用CPU模式，即使有可用的GPU")
+    sync_timeout: float = Field(default=600, gt=0, description="同步任务等待结果的最长时间（秒）")
+    durable_push: bool = Field(default=False, description="异步提交任务时是否等待任务记录写入数据库后再返回")
 
 # 从环境变量中读取配置，如果没有设置则使用默认值
 force_cpu_env = os.environ.get('FORCE_CPU', 'false').lower() == 'true'
+durable_push_env = os.environ.get('DURABLE_PUSH', 'false').lower() == 'true'
 
 # 全局配置实例
-config = SystemConfig(force_cpu=force_cpu_env)
\ No newline at end of file
+config = SystemConfig(force_cpu=force_cpu_env, durable_push=durable_push_env)
\ No newline at end of file
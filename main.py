@@ -1,23 +1,27 @@
 import sys
-import os
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
 import asyncio
 import torch  # 用于检测GPU数量
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles # 导入StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from router.job import router as job_router, config_router, get_queue
 from router.device import router as device_router
 from task_queue.priority_queue import PriorityQueue
+from task_queue.dispatcher import TaskDispatcher
 from uvicorn.server import logger
 from worker.asr_worker import ASRWorker
 from models import TaskStatus
-import json
+import orjson
+import zlib
 
 # 初始化FastAPI应用
-app = FastAPI(title="ASR Service", description="一个带优先级队列的ASR语音转文字服务")
+# 默认使用orjson序列化JSON响应，与WebSocket广播保持一致
+app = FastAPI(
+    title="ASR Service",
+    description="一个带优先级队列的ASR语音转文字服务",
+    default_response_class=ORJSONResponse,
+)
 
 # 允许跨域请求
 app.add_middleware(
@@ -45,16 +49,19 @@ else:
     gpu_count = torch.cuda.device_count() if torch.cuda.is_available() else 0
     logger.info(f"检测到 {gpu_count} 个GPU")
 
+# 创建任务分发线程，由它统一从全局队列取任务并分发给各工作者
+task_dispatcher = TaskDispatcher(asr_queue, worker_count=max(gpu_count, 1))
+
 # 创建多个ASR工作者实例以支持多卡调度
 asr_workers = []
 if gpu_count > 0:
     # 为每个GPU创建一个工作者实例
     for i in range(gpu_count):
-        worker = ASRWorker(asr_queue, device=f"cuda:{i}")
+        worker = ASRWorker(asr_queue, device=f"cuda:{i}", dispatcher=task_dispatcher, index=i)
         asr_workers.append(worker)
 else:
     # 如果没有GPU，创建一个使用CPU的工作者实例
-    worker = ASRWorker(asr_queue, device="cpu")
+    worker = ASRWorker(asr_queue, device="cpu", dispatcher=task_dispatcher, index=0)
     asr_workers.append(worker)
 
 # 为了保持向后兼容性，仍然提供单个worker的引用
@@ -87,76 +94,159 @@ app.include_router(device_router, prefix="/api/device", tags=["Device Info"])
 
 
 # --- WebSocket后台管理 ---
+# 每个客户端待发送消息队列的容量，超出时视为慢客户端
+CLIENT_QUEUE_SIZE = 32
+# 收到第一个状态变化后等待的时间（秒），以便将突发的多个变化合并为一帧
+BROADCAST_COALESCE_WINDOW = 0.05
+# 状态中的任务条目超过该数量时，在线程中进行JSON编码
+LARGE_STATUS_THRESHOLD = 64
+# 广播帧的zlib压缩级别，1最快，对JSON已有足够的压缩率
+FRAME_COMPRESS_LEVEL = 1
+
 class ConnectionManager:
-    """管理WebSocket连接"""
+    """
+    管理WebSocket连接。
+    - 每个连接拥有独立的待发送队列和写协程，广播只需入队，不会阻塞在网络发送上。
+    - 慢客户端的积压只影响自身，不会拖慢其他客户端。
+    """
     def __init__(self):
-        # 存放活跃的WebSocket连接
-        self.active_connections: list[WebSocket] = []
+        # 存放活跃的WebSocket连接及其待发送消息队列
+        self.active_connections: dict[WebSocket, asyncio.Queue] = {}
+        # 每个连接对应的写协程
+        self._writers: dict[WebSocket, asyncio.Task] = {}
+        # 最近一次的完整状态快照（已编码），供新连接初始化使用
+        self.snapshot: bytes | None = None
 
     async def connect(self, websocket: WebSocket):
         """接受新的WebSocket连接"""
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        # 先发送一份完整快照，后续只接收增量变化
+        if self.snapshot is not None:
+            queue.put_nowait(self.snapshot)
+        self.active_connections[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
 
     def disconnect(self, websocket: WebSocket):
         """断开WebSocket连接"""
-        self.active_connections.remove(websocket)
+        # 连接可能已在发送失败时被移除
+        self.active_connections.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
 
-    async def broadcast(self, message: str):
-        """向所有连接的客户端广播消息"""
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """逐条发送该连接队列中的消息，发送失败视为连接已断开"""
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_bytes(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.active_connections.pop(websocket, None)
+            self._writers.pop(websocket, None)
+
+    def broadcast(self, payload: bytes):
+        """向所有连接的客户端广播已编码的消息（仅入队，不等待发送）"""
+        for queue in self.active_connections.values():
+            if queue.full():
+                # 客户端消费过慢：丢弃积压的增量，改为发送最新的完整快照
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot if self.snapshot is not None else payload)
+            else:
+                queue.put_nowait(payload)
 
 manager = ConnectionManager()
 
+# 状态值与结果展示文本在模块加载时预先生成，构建快照时直接查表
+_STATUS_VALUE = {status: sys.intern(status.value) for status in TaskStatus}
+_RESULT_DISPLAY = {
+    TaskStatus.COMPLETED: "详情",
+    TaskStatus.FAILED: "失败，点击查看详情",
+}
+_NO_RESULT_DISPLAY = "N/A"
+_PROCESSING_DISPLAY = "处理中..."
+
+def _task_columns(tasks: list, result_display: list) -> dict:
+    """将任务列表按列组织，每个字段一个数组，减少小对象的创建与序列化开销"""
+    return {
+        "id": [task.id for task in tasks],
+        "priority": [task.priority for task in tasks],
+        "status": [_STATUS_VALUE[task.status] for task in tasks],
+        "waiting_time": [task.waiting_time for task in tasks],
+        "processing_time": [task.processing_time for task in tasks],
+        "result_display": result_display,
+    }
+
+def build_queue_status() -> dict:
+    """构建队列状态快照，用于前端展示。各任务列表按列组织，由前端还原为行。"""
+    # 获取队列中任务的快照信息
+    tasks_snapshot = asr_queue.get_pending_view()
+    # 获取最近处理的任务列表（最近10个）
+    recent_tasks = asr_queue.get_recent_tasks(limit=10)
+    # 为了减少数据传输量，对结果进行截断处理
+    recent_tasks_data = _task_columns(recent_tasks, [
+        _RESULT_DISPLAY.get(task.status, _NO_RESULT_DISPLAY) if task.result else _NO_RESULT_DISPLAY
+        for task in recent_tasks
+    ])
+
+    # 获取正在处理中的任务列表，结果显示为“处理中...”
+    processing_tasks = asr_queue.get_processing_tasks()
+    processing_tasks_data = _task_columns(processing_tasks, [_PROCESSING_DISPLAY] * len(processing_tasks))
+
+    return {
+        "queue_size": asr_queue.size,
+        "pending_tasks": tasks_snapshot,
+        "processing_tasks": processing_tasks_data, # 新增
+        "recent_tasks": recent_tasks_data
+    }
+
+def _encode_frame(obj) -> bytes:
+    """将对象编码为JSON并以zlib压缩，每帧只压缩一次，所有连接共享同一份结果"""
+    return zlib.compress(orjson.dumps(obj), FRAME_COMPRESS_LEVEL)
+
+async def encode_frame(obj, offload: bool = False) -> bytes:
+    """编码广播帧，offload为True时在线程池中执行"""
+    if offload:
+        return await asyncio.to_thread(_encode_frame, obj)
+    return _encode_frame(obj)
+
 async def broadcast_queue_status():
-    """定期向所有后台前端广播队列状态"""
+    """
+    向所有后台前端广播队列状态的增量变化。
+    - 新连接建立时会先收到一份完整快照（见ConnectionManager.connect）。
+    - 由队列的状态变化事件驱动，没有变化时不做任何工作。
+    - 一段时间内的多个变化会被合并，只重新构建一次状态并发送一帧。
+    """
+    loop = asyncio.get_running_loop()
+    updates: asyncio.Queue[int] = asyncio.Queue()
+    # 队列的变更可能发生在工作者线程中，需要线程安全地投递到事件循环
+    asr_queue.add_listener(lambda version: loop.call_soon_threadsafe(updates.put_nowait, version))
+    # 启动时先构建一次，为新连接准备初始快照
+    updates.put_nowait(asr_queue.version)
+    last_status = {}
     while True:
-        # 获取队列中任务的快照信息，用于前端展示
-        tasks_snapshot = [{"id": t[2], "priority": -t[0]} for t in asr_queue._queue] # 负号反转优先级
-        # 获取最近处理的任务列表
-        recent_tasks_data = []
-        for task in asr_queue.get_recent_tasks(limit=10): # 获取最近10个任务
-            # 为了减少数据传输量，对结果进行截断处理
-            result_display = "N/A"
-            if task.result:
-                if task.status == TaskStatus.COMPLETED:
-                    result_display = "详情"
-                elif task.status == TaskStatus.FAILED:
-                     result_display = "失败，点击查看详情"
-
-            recent_tasks_data.append({
-                "id": task.id,
-                "priority": task.priority,
-                "status": task.status.value,
-                "waiting_time": task.waiting_time,
-                "processing_time": task.processing_time,
-                "result_display": result_display # 使用截断后的结果
-            })
-
-        # 获取正在处理中的任务列表
-        processing_tasks_data = []
-        for task in asr_queue.get_processing_tasks():
-            # 正在处理中的任务，result_display可以显示为"处理中..."或者不显示
-            processing_tasks_data.append({
-                "id": task.id,
-                "priority": task.priority,
-                "status": task.status.value,
-                "waiting_time": task.waiting_time,
-                "processing_time": task.processing_time,
-                "result_display": "处理中..." # 正在处理中的任务，结果显示为“处理中...”
-            })
-
-        status = {
-            "queue_size": asr_queue.size,
-            "pending_tasks": tasks_snapshot,
-            "processing_tasks": processing_tasks_data, # 新增
-            "recent_tasks": recent_tasks_data
-        }
-        # 广播JSON格式的状态信息
-        await manager.broadcast(json.dumps(status))
-        # 每1秒广播一次
-        await asyncio.sleep(1)
+        await updates.get()
+        await asyncio.sleep(BROADCAST_COALESCE_WINDOW)
+        # 取出等待期间积累的所有变化事件，合并处理
+        while True:
+            try:
+                updates.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        status = build_queue_status()
+        # 只保留与上次相比发生变化的顶层字段
+        changes = {key: value for key, value in status.items() if last_status.get(key) != value}
+        last_status = status
+        # 任务条目较多时在线程中编码，避免阻塞事件循环
+        task_count = sum(len(status[key]["id"]) for key in ("pending_tasks", "processing_tasks", "recent_tasks"))
+        offload = task_count > LARGE_STATUS_THRESHOLD
+        manager.snapshot = await encode_frame({"type": "snapshot", **status}, offload)
+        if changes:
+            # 广播JSON格式的增量信息
+            manager.broadcast(await encode_frame({"type": "patch", "changes": changes}, offload))
 
 async def run_cleanup_scheduler():
     """定期运行数据库清理任务"""
@@ -166,7 +256,8 @@ async def run_cleanup_scheduler():
         logger.info("开始执行定期的数据库清理任务...")
         try:
             # 清理30分钟前的旧任务音频数据
-            asr_queue.cleanup_old_audio_data(minutes=30)
+            # 清理涉及SQLite和文件系统的阻塞操作，放到线程中执行以免阻塞事件循环
+            await asyncio.to_thread(asr_queue.cleanup_old_audio_data, minutes=30)
         except Exception as e:
             logger.error(f"执行数据库清理任务时出错: {e}")
 
@@ -175,10 +266,11 @@ async def websocket_endpoint(websocket: WebSocket):
     """WebSocket通信端点，用于后台实时监控"""
     await manager.connect(websocket)
     try:
-        while True:
-            # 等待客户端消息，保持连接
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+        # 客户端不会主动发送消息，这里只等待断开事件；
+        # 连接是否存活由服务器协议层的ping/pong检测（见--ws-ping-interval）
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
         manager.disconnect(websocket)
         logger.info("A client disconnected from dashboard.")
 
@@ -191,6 +283,8 @@ async def startup_event():
         worker.start()
         logger.info(f"ASR Worker {i} (设备: {worker.device}) 已启动")
     app.state.workers = asr_workers
+    # 启动任务分发线程
+    task_dispatcher.start()
     # 在后台启动一个任务，用于定期广播队列状态
     asyncio.create_task(broadcast_queue_status())
     # 在后台启动数据库清理调度器
@@ -200,21 +294,26 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时执行"""
+    # 先停止任务分发线程，不再向工作者分发新任务
+    task_dispatcher.stop()
+    task_dispatcher.join()
     # 停止所有ASR工作者线程
     for i, worker in enumerate(app.state.workers):
         worker.stop()
         worker.join()
         logger.info(f"ASR Worker {i} 已停止")
     logger.info("所有ASR Worker均已停止。")
+    # 写入缓冲区中尚未持久化的任务并关闭数据库连接
+    asr_queue.close()
 
 # --- 管理后台HTML页面 ---
-@app.get("/", response_class=HTMLResponse, tags=["Dashboard"])
+# 使用FileResponse返回页面，由服务器通过sendfile直接发送文件内容，无需读入Python内存
+@app.get("/", response_class=FileResponse, tags=["Dashboard"])
 async def get_admin_dashboard():
     """提供一个简单的HTML页面作为管理后台"""
-    # 直接返回静态文件
-    return HTMLResponse(content=open("static/index.html", "r").read())
+    return FileResponse("static/index.html", media_type="text/html")
 
-@app.get("/history.html", response_class=HTMLResponse, tags=["Dashboard"])
+@app.get("/history.html", response_class=FileResponse, tags=["Dashboard"])
 async def get_history_page():
     """提供历史任务查看页面"""
-    return HTMLResponse(content=open("static/history.html", "r").read())
+    return FileResponse("static/history.html", media_type="text/html")
@@ -1,4 +1,5 @@
 import sqlite3
+import uuid
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
@@ -10,7 +11,7 @@ class TaskStatus(Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: str
     audio_filepath: Optional[str] # 存储音频文件路径
@@ -22,22 +23,108 @@ class Task:
     waiting_time: Optional[float] = None # 等待时间 (从创建到开始处理)
     processing_time: Optional[float] = None # 处理时间 (从开始处理到完成/失败)
 
-def init_db():
-    conn = sqlite3.connect('asr_queue.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id TEXT PRIMARY KEY,
+# 数据库结构版本，记录在 PRAGMA user_version 中
+# 1: 任务ID由36字符的TEXT改为16字节的BLOB
+# 2: created_at/updated_at由本地时间字符串改为Unix纪元秒（REAL）
+SCHEMA_VERSION = 2
+
+TASKS_TABLE_SQL = '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BLOB PRIMARY KEY,
             audio_filepath TEXT,
             priority INTEGER DEFAULT 0,
             status TEXT CHECK(status IN ('pending', 'processing', 'completed', 'failed')),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP,
+            created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+            updated_at REAL,
             result TEXT,
             waiting_time REAL,
             processing_time REAL
         )
+    '''
+
+def _migrate_ids_to_blob(conn):
+    """将旧版TEXT格式的UUID主键迁移为16字节BLOB（重建tasks表）"""
+    conn.create_function(
+        "uuid_blob", 1, lambda value: uuid.UUID(value).bytes if isinstance(value, str) else value,
+        deterministic=True,
+    )
+    cursor = conn.cursor()
+    # 整个重建过程放在一个事务中，由init_db最后统一提交
+    cursor.execute("BEGIN")
+    cursor.execute(TASKS_TABLE_SQL.format(table="tasks_new"))
+    cursor.execute('''
+        INSERT INTO tasks_new
+        SELECT uuid_blob(id), audio_filepath, priority, status, created_at, updated_at,
+               result, waiting_time, processing_time
+        FROM tasks
+    ''')
+    cursor.execute("DROP TABLE tasks")
+    cursor.execute("ALTER TABLE tasks_new RENAME TO tasks")
+
+def _migrate_timestamps_to_epoch(conn):
+    """将旧版本地时间字符串格式的时间戳迁移为Unix纪元秒"""
+    cursor = conn.cursor()
+    for column in ("created_at", "updated_at"):
+        cursor.execute(f'''
+            UPDATE tasks SET {column} = (julianday({column}, 'utc') - 2440587.5) * 86400.0
+            WHERE typeof({column}) = 'text'
+        ''')
+
+def init_db(db_path: str = 'asr_queue.db'):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    # WAL模式会持久化到数据库文件中，读操作不再阻塞写操作，提交时也只需顺序追加日志
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA user_version")
+    schema_version = cursor.fetchone()[0]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks'")
+    tasks_exists = cursor.fetchone() is not None
+    cursor.execute(TASKS_TABLE_SQL.format(table="tasks"))
+    migrated = False
+    if tasks_exists and schema_version < 1:
+        _migrate_ids_to_blob(conn)
+        migrated = True
+    if tasks_exists and schema_version < 2:
+        _migrate_timestamps_to_epoch(conn)
+        migrated = True
+    # 按分钟聚合的已结束任务统计，任务结束时增量累加，统计查询只需读取少量行
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'stats_buckets'")
+    backfill_stats = cursor.fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_buckets (
+            minute_epoch INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum_wait REAL NOT NULL DEFAULT 0,
+            sum_proc REAL NOT NULL DEFAULT 0
+        )
     ''')
+    if backfill_stats:
+        # 首次创建时用最近一小时已结束的任务回填
+        cursor.execute('''
+            INSERT INTO stats_buckets (minute_epoch, count, sum_wait, sum_proc)
+            SELECT
+                CAST(updated_at AS INTEGER) / 60,
+                COUNT(waiting_time),
+                COALESCE(SUM(waiting_time), 0),
+                COALESCE(SUM(processing_time - waiting_time), 0)
+            FROM tasks
+            WHERE status IN ('completed', 'failed')
+              AND updated_at >= (julianday('now') - 2440587.5) * 86400.0 - 3600
+            GROUP BY 1
+        ''')
+    # 定期清理按 status + created_at 过滤，建立索引避免全表扫描
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at)"
+    )
+    # 最近任务、历史记录和统计按 status 过滤并按 updated_at 排序或限定范围
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_updated ON tasks(status, updated_at DESC)"
+    )
+    # 首次建立索引或迁移重建表后收集一次统计信息，便于查询规划器选择索引
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    if cursor.fetchone() is None or migrated:
+        cursor.execute("ANALYZE")
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
@@ -1,9 +1,50 @@
+import os
+import re
+from functools import lru_cache
+import torch
 from fastapi import APIRouter, Depends
 from uvicorn.server import logger
 from config import config
 
 router = APIRouter()
 
+# 硬件信息在进程运行期间不会变化，首次查询后缓存结果
+@lru_cache(maxsize=None)
+def _get_gpu_info(device_id: int) -> str:
+    """获取指定GPU的型号和显存信息"""
+    gpu_name = torch.cuda.get_device_name(device_id)
+    gpu_memory = torch.cuda.get_device_properties(device_id).total_memory / (1024**3)  # 转换为GB
+    return f"{gpu_name} ({gpu_memory:.1f}GB)"
+
+@lru_cache(maxsize=None)
+def _get_cpu_info() -> tuple:
+    """解析/proc/cpuinfo，返回 (设备信息, 设备类型)"""
+    # 读取CPU信息
+    with open('/proc/cpuinfo', 'r') as f:
+        cpuinfo = f.read()
+
+    # 获取CPU型号
+    cpu_model_match = re.search(r'model name\s*:\s*(.+)', cpuinfo)
+    cpu_model = cpu_model_match.group(1).strip() if cpu_model_match else "Unknown CPU"
+
+    # 获取逻辑核心数
+    logical_cores = os.cpu_count()
+
+    # 获取物理CPU插槽数
+    physical_ids = set(re.findall(r'physical id\s*:\s*(\d+)', cpuinfo))
+    socket_count = len(physical_ids) if physical_ids else 1
+
+    device_info = f"{logical_cores} x {cpu_model} ({socket_count} 插槽)"
+
+    # 检测CPU厂商
+    if "AMD" in cpu_model.upper():
+        device_type_str = "AMD_CPU"
+    elif "INTEL" in cpu_model.upper():
+        device_type_str = "INTEL_CPU"
+    else:
+        device_type_str = "CPU"
+    return device_info, device_type_str
+
 # 依赖函数，用于获取ASRWorker实例
 def get_asr_worker():
     """获取ASRWorker实例的依赖函数"""
@@ -16,10 +57,6 @@ def get_device_info(worker=Depends(get_asr_worker)):
     获取当前设备的基本信息。
     - 根据ASRWorker的实际配置返回设备信息。
     """
-    import os
-    import re
-    import torch
-    
     try:
         # 获取ASRWorker配置的设备类型
         if worker is None:
@@ -45,9 +82,7 @@ def get_device_info(worker=Depends(get_asr_worker)):
                     # 如果是"cuda"格式，默认使用设备0
                     device_id = 0
                 
-                gpu_name = torch.cuda.get_device_name(device_id)
-                gpu_memory = torch.cuda.get_device_properties(device_id).total_memory / (1024**3)  # 转换为GB
-                device_info = f"{gpu_name} ({gpu_memory:.1f}GB)"
+                device_info = _get_gpu_info(device_id)
                 device_type_str = "GPU"
             except Exception as e:
                 # 如果获取GPU信息失败，可能是配置错误
@@ -55,30 +90,7 @@ def get_device_info(worker=Depends(get_asr_worker)):
                 device_type_str = "GPU"
         else:
             # CPU信息
-            # 读取CPU信息
-            with open('/proc/cpuinfo', 'r') as f:
-                cpuinfo = f.read()
-            
-            # 获取CPU型号
-            cpu_model_match = re.search(r'model name\s*:\s*(.+)', cpuinfo)
-            cpu_model = cpu_model_match.group(1).strip() if cpu_model_match else "Unknown CPU"
-            
-            # 获取逻辑核心数
-            logical_cores = os.cpu_count()
-            
-            # 获取物理CPU插槽数
-            physical_ids = set(re.findall(r'physical id\s*:\s*(\d+)', cpuinfo))
-            socket_count = len(physical_ids) if physical_ids else 1
-            
-            device_info = f"{logical_cores} x {cpu_model} ({socket_count} 插槽)"
-            
-            # 检测CPU厂商
-            if "AMD" in cpu_model.upper():
-                device_type_str = "AMD_CPU"
-            elif "INTEL" in cpu_model.upper():
-                device_type_str = "INTEL_CPU"
-            else:
-                device_type_str = "CPU"
+            device_info, device_type_str = _get_cpu_info()
         
         # 添加配置信息到返回结果
         config_info = f"(配置: {configured_device})"
@@ -1,18 +1,16 @@
-import sys
 import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 import asyncio
+import aiofiles
 from fastapi import APIRouter, File, UploadFile, BackgroundTasks, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from task_queue.priority_queue import PriorityQueue, AUDIO_STORAGE_DIR
-from models import TaskStatus
+from task_queue.priority_queue import PriorityQueue
 from uvicorn.server import logger
 # 导入配置模块
 from config import config, SystemConfig
 import time
 import uuid
+from typing import Optional
 
 # 为任务和配置创建不同的路由
 router = APIRouter()
@@ -43,8 +41,8 @@ def get_asr_worker():
     raise NotImplementedError("This should be overridden in main.py")
 
 # --- 辅助函数：保存音频文件 ---
-async def save_audio_file(audio_file: UploadFile) -> str:
-    """将上传的音频文件保存到文件系统，并返回文件路径。"""
+async def save_audio_file(audio_file: UploadFile, audio_dir: str) -> str:
+    """将上传的音频文件保存到队列的音频目录中，并返回文件路径。"""
     # 确保文件名不为空，并获取文件扩展名
     if audio_file.filename:
         file_extension = audio_file.filename.split(".")[-1] if "." in audio_file.filename else "wav"
@@ -52,14 +50,15 @@ async def save_audio_file(audio_file: UploadFile) -> str:
         file_extension = "wav" # 默认扩展名
     
     filename = f"{uuid.uuid4()}.{file_extension}"
-    filepath = os.path.join(AUDIO_STORAGE_DIR, filename)
+    filepath = os.path.join(audio_dir, filename)
     
     # 确保目录存在
-    os.makedirs(AUDIO_STORAGE_DIR, exist_ok=True)
+    os.makedirs(audio_dir, exist_ok=True)
 
-    with open(filepath, "wb") as f:
+    # 使用aiofiles异步写入，避免阻塞事件循环
+    async with aiofiles.open(filepath, "wb") as f:
         while contents := await audio_file.read(1024 * 1024): # 分块读取，避免大文件一次性读入内存
-            f.write(contents)
+            await f.write(contents)
     return filepath
 
 # --- API端点 ---
@@ -80,9 +79,13 @@ async def create_asr_task(
         raise HTTPException(status_code=429, detail="服务器繁忙，请稍后再试 (队列已满)")
         
     # 保存音频文件到文件系统
-    audio_filepath = await save_audio_file(audio_file)
+    audio_filepath = await save_audio_file(audio_file, asr_queue.audio_dir)
     # 将任务推入队列，只存储文件路径
-    task_id = asr_queue.push(audio_filepath, priority) # 这里的push方法现在接受的是filepath
+    if config.durable_push:
+        # 等待任务记录提交，提交期间不阻塞事件循环
+        task_id = await asyncio.to_thread(asr_queue.push, audio_filepath, priority, True)
+    else:
+        task_id = asr_queue.push(audio_filepath, priority) # 这里的push方法现在接受的是filepath
     # 返回任务ID和状态查询URL
     return {"task_id": task_id, "status_url": f"/api/asr/status/{task_id}"}
 
@@ -104,18 +107,16 @@ async def create_asr_task_sync(
         raise HTTPException(status_code=429, detail="服务器繁忙，请稍后再试 (队列已满)")
 
     # 保存音频文件到文件系统
-    audio_filepath = await save_audio_file(audio_file)
+    audio_filepath = await save_audio_file(audio_file, asr_queue.audio_dir)
     # 将任务推入队列，只存储文件路径
     task_id = asr_queue.push(audio_filepath, priority) # 这里的push方法现在接受的是filepath
 
-    # 循环等待任务完成
-    while True:
-        task = asr_queue.get_task(task_id)
-        if task and task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-            # 任务完成或失败，返回结果
-            return {"task_id": task_id, "status": task.status.value, "result": task.result}
-        # 短暂休眠，避免CPU空转
-        await asyncio.sleep(0.1)
+    # 等待工作者通知任务结束，无需轮询
+    if not await asr_queue.wait_for(task_id, timeout=config.sync_timeout):
+        raise HTTPException(status_code=504, detail="任务处理超时，请稍后通过状态查询接口获取结果")
+    task = asr_queue.get_task(task_id)
+    # 任务完成或失败，返回结果
+    return {"task_id": task_id, "status": task.status.value, "result": task.result}
 
 @router.post("/asr/sse", summary="提交SSE流式ASR任务")
 async def create_asr_task_sse(
@@ -136,7 +137,7 @@ async def create_asr_task_sse(
         raise HTTPException(status_code=429, detail="服务器繁忙，请稍后再试 (队列已满)")
 
     # 保存音频文件到文件系统
-    audio_filepath = await save_audio_file(audio_file)
+    audio_filepath = await save_audio_file(audio_file, asr_queue.audio_dir)
     
     # 定义生成SSE事件的函数
     async def event_generator():
@@ -217,6 +218,7 @@ async def get_history_tasks(
     page: int = 1,
     page_size: int = 50,
     status: str = "all",
+    cursor: Optional[str] = None,
     asr_queue: PriorityQueue = Depends(get_queue)
 ):
     """
@@ -224,6 +226,7 @@ async def get_history_tasks(
     - page: 页码，从1开始
     - page_size: 每页任务数量，默认50，最大100
     - status: 状态过滤，可选值：'completed', 'failed', 'all'
+    - cursor: 上一页响应中的next_cursor，提供时直接从该位置继续（键集分页），此时响应中的total_pages、current_page、has_prev为null
     """
     # 限制每页最大数量
     if page_size > 100:
@@ -237,7 +240,10 @@ async def get_history_tasks(
     if status not in ['completed', 'failed', 'all']:
         status = 'all'
     
-    return asr_queue.get_history_tasks(page, page_size, status)
+    try:
+        return asr_queue.get_history_tasks(page, page_size, status, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # --- 配置 API 端点 ---
@@ -253,6 +259,9 @@ async def update_config(new_config: SystemConfig):
     例如，可以用来调整队列的最大容量。
     """
     config.max_queue_size = new_config.max_queue_size
-    logger.info(f"系统配置已更新 - 队列最大容量: {config.max_queue_size}")
+    # 管理后台只提交max_queue_size，未显式提交的字段保持原值
+    if "durable_push" in new_config.model_fields_set:
+        config.durable_push = new_config.durable_push
+    logger.info(f"系统配置已更新 - 队列最大容量: {config.max_queue_size}, 持久化提交: {config.durable_push}")
     return config
 
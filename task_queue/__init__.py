@@ -0,0 +1 @@
+"""任务队列：持久化优先级队列与多卡任务分发。"""
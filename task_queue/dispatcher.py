@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+from typing import Optional, List
+from uvicorn.server import logger
+
+from task_queue.priority_queue import PriorityQueue
+
+DISPATCH_RETRY_DELAY = 0.5  # 出队失败后重试前的等待时间（秒）
+
+
+class TaskDispatcher(threading.Thread):
+    """
+    任务分发线程，用于多卡调度。
+    - 作为全局优先级队列的唯一消费者，将任务分发到各工作者的本地队列。
+    - 工作者只从自己的本地队列(deque)取任务，不再竞争全局队列的锁。
+    - 工作者空闲时会从其他工作者本地队列的尾部窃取任务。
+    - 只在工作者有空位时才从全局队列出队，避免高优先级任务被提前分配的任务阻塞。
+    """
+
+    def __init__(self, queue: PriorityQueue, worker_count: int, local_capacity: int = 1):
+        """
+        Args:
+            queue (PriorityQueue): 全局优先级队列
+            worker_count (int): 工作者数量
+            local_capacity (int): 每个工作者同时持有的任务数上限（含正在处理的任务）
+        """
+        super().__init__()
+        self.queue = queue
+        self.local_capacity = local_capacity
+        self.local_queues: List[deque] = [deque() for _ in range(worker_count)]
+        self._ready = [threading.Event() for _ in range(worker_count)]  # 本地队列有新任务
+        self._busy = [False] * worker_count  # 工作者是否正在处理任务
+        self._slot_available = threading.Event()  # 有工作者出现空位
+        self.stop_event = threading.Event()
+        self.daemon = True
+
+    def _load(self, index: int) -> int:
+        """工作者当前持有的任务数"""
+        return len(self.local_queues[index]) + (1 if self._busy[index] else 0)
+
+    def _pick_worker(self) -> Optional[int]:
+        """选择负载最小且未满的工作者，全部已满时返回None"""
+        index = min(range(len(self.local_queues)), key=self._load)
+        return index if self._load(index) < self.local_capacity else None
+
+    def run(self):
+        """线程的主执行逻辑"""
+        logger.info(f"任务分发线程已启动，工作者数量: {len(self.local_queues)}")
+        while not self.stop_event.is_set():
+            index = self._pick_worker()
+            if index is None:
+                # 所有工作者都已满，等待有工作者空出位置
+                self._slot_available.wait(timeout=1.0)
+                self._slot_available.clear()
+                continue
+            try:
+                task_id = self.queue.pop_blocking(timeout=1.0)
+            except Exception as e:
+                # 出队失败（如数据库暂时不可写）时不能让分发线程退出，否则所有工作者都将饿死
+                logger.error(f"从全局队列取任务时出错: {e}")
+                self.stop_event.wait(DISPATCH_RETRY_DELAY)
+                continue
+            if task_id:
+                self.local_queues[index].append(task_id)
+                self._ready[index].set()
+
+    def _take_local(self, index: int) -> Optional[str]:
+        """从本地队列头部取任务，本地为空时从其他工作者本地队列尾部窃取"""
+        try:
+            return self.local_queues[index].popleft()
+        except IndexError:
+            pass
+        for other, local_queue in enumerate(self.local_queues):
+            if other == index:
+                continue
+            try:
+                task_id = local_queue.pop()
+            except IndexError:
+                continue
+            # 被窃取的工作者出现了空位
+            self._slot_available.set()
+            return task_id
+        return None
+
+    def take(self, index: int, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        工作者获取下一个任务，无任务时阻塞等待。
+
+        Args:
+            index (int): 工作者编号
+            timeout (float, optional): 超时时间（秒），None表示无限等待
+
+        Returns:
+            Optional[str]: 任务ID，超时返回None
+        """
+        # 先标记为忙碌，避免取任务期间分发线程误判出空位
+        self._busy[index] = True
+        task_id = self._take_local(index)
+        if task_id is None:
+            self._busy[index] = False
+            self._slot_available.set()
+            self._ready[index].wait(timeout)
+            self._ready[index].clear()
+            self._busy[index] = True
+            task_id = self._take_local(index)
+            if task_id is None:
+                self._busy[index] = False
+        return task_id
+
+    def done(self, index: int):
+        """工作者处理完一个任务后调用，通知分发线程出现空位"""
+        self._busy[index] = False
+        self._slot_available.set()
+
+    def wake(self, index: int):
+        """唤醒可能在等待任务的工作者，使其能够快速检查停止条件"""
+        self._ready[index].set()
+
+    def stop(self):
+        """设置事件，通知线程停止"""
+        self.stop_event.set()
+        self._slot_available.set()
+        self.queue.wake_waiters()
@@ -0,0 +1,77 @@
+import heapq
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class IndexedHeap:
+    """
+    以键索引的最小堆。
+    - 堆操作直接使用heapq（C实现），入堆/出堆为O(log n)。
+    - 额外维护 键 -> 堆条目 的字典，支持O(1)判断存在、O(log n)删除和替换条目。
+    - 删除采用惰性标记：被删除或被替换的条目留在堆中，出堆时跳过；
+      失效条目超过一半时重建堆，避免堆无限增长。
+    - 条目为元组，最后一个元素为键，键在堆中唯一。
+    """
+
+    def __init__(self, entries: Iterable[Tuple] = ()):
+        """
+        Args:
+            entries (Iterable[Tuple]): 初始条目，使用heapify一次性建堆（O(n)）；键重复时保留最后一个
+        """
+        self._entries: Dict[Hashable, Tuple] = {entry[-1]: entry for entry in entries}  # 键 -> 当前有效的堆条目
+        self._heap: List[Tuple] = list(self._entries.values())
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def push(self, entry: Tuple):
+        """加入一个条目，键已存在时替换原条目"""
+        key = entry[-1]
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self) -> Tuple:
+        """弹出最小的有效条目，堆为空时抛出IndexError"""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._entries.get(entry[-1]) is entry:
+                del self._entries[entry[-1]]
+                return entry
+        raise IndexError("pop from an empty heap")
+
+    def peek(self) -> Optional[Tuple]:
+        """返回最小的有效条目但不弹出，堆为空时返回None"""
+        while self._heap:
+            entry = self._heap[0]
+            if self._entries.get(entry[-1]) is entry:
+                return entry
+            heapq.heappop(self._heap)
+        return None
+
+    def remove(self, key: Hashable) -> Optional[Tuple]:
+        """删除指定键的条目，返回被删除的条目，键不存在时返回None"""
+        if key not in self._entries:
+            return None
+        return self._discard(key)
+
+    def update(self, entry: Tuple):
+        """用新条目替换同键的条目（例如修改优先级），键不存在时抛出KeyError"""
+        if entry[-1] not in self._entries:
+            raise KeyError(entry[-1])
+        self.push(entry)
+
+    def _discard(self, key: Hashable) -> Tuple:
+        """标记条目失效，必要时重建堆以清除失效条目"""
+        entry = self._entries.pop(key)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        return entry
@@ -1,96 +1,399 @@
-import sys
+import asyncio
+import atexit
+import itertools
 import os
-
-# 将项目根目录添加到Python路径中，以解决模块导入问题
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-import heapq
 import sqlite3
 import threading
 import time
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from uvicorn.server import logger
-from datetime import datetime, timedelta
-from typing import Optional, List
+from datetime import datetime
+from enum import Enum
+from typing import Optional, List, Dict, Tuple, Callable
 
 from models import Task, TaskStatus, init_db
-
-# 定义存储音频文件的目录
+from task_queue.indexed_heap import IndexedHeap
+
+# SQLite遇到锁时的最长等待时间（毫秒）
+SQLITE_BUSY_TIMEOUT_MS = 5000
+# 每个连接的页缓存大小（KiB），负数表示按KiB计算
+SQLITE_CACHE_SIZE_KIB = 20000
+# WAL文件达到该页数后由提交的连接自动执行被动检查点，不等待读者、不阻塞写入
+SQLITE_WAL_AUTOCHECKPOINT_PAGES = 1000
+# 内存映射读取的数据库文件大小上限（字节），读取时省去从内核缓冲区到页缓存的拷贝
+SQLITE_MMAP_SIZE = 268435456
+
+# 新任务批量写入数据库：攒批等待时间（秒）与单个事务的最大行数
+INSERT_FLUSH_INTERVAL = 0.05
+INSERT_BATCH_SIZE = 500
+
+# 历史任务总数的缓存时间（秒）与页码->游标缓存的容量
+HISTORY_COUNT_TTL = 10
+HISTORY_CURSOR_CACHE_SIZE = 256
+
+# 清理音频文件时，超过该数量改为线程池并发删除，以及线程池的线程数
+UNLINK_PARALLEL_THRESHOLD = 32
+UNLINK_MAX_WORKERS = 8
+
+# 统计桶保留的分钟数，需覆盖统计接口查询的最长区间（45分钟），更早的桶在定期清理时删除
+STATS_BUCKET_RETENTION_MINUTES = 60
+
+# 每个连接缓存的预编译语句数量
+SQLITE_CACHED_STATEMENTS = 256
+
+# 热路径SQL集中定义为常量，保证语句文本一致以命中连接的语句缓存
+SQL_INSERT_TASK = "INSERT INTO tasks (id, audio_filepath, priority, status, created_at) VALUES (?, ?, ?, ?, ?)"
+# 等待时间在SQL中由记录的created_at计算，“当前时间”由Python传入
+SQL_MARK_PROCESSING = "UPDATE tasks SET status = ?, waiting_time = ? - created_at WHERE id = ?"
+# Task字段对应的列，查询时按此顺序选取，行工厂按位置读取
+TASK_COLUMNS = "id, audio_filepath, priority, status, created_at, updated_at, result, waiting_time, processing_time"
+# 已结束任务展示用的列：processing_time在SQL中扣除等待时间，得到纯处理时间（任一为NULL时结果为NULL）
+FINISHED_TASK_COLUMNS = TASK_COLUMNS.replace(
+    "processing_time", "processing_time - waiting_time AS processing_time"
+)
+SQL_SELECT_TASK = f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = ?"
+# 如果是第一次更新，则updated_at是None，此时处理时间从created_at算起，否则从上一次updated_at算起。
+# 时间戳为Unix纪元秒（REAL），“当前时间”由Python传入。
+SQL_UPDATE_STATUS = """
+    UPDATE tasks
+    SET status = :status,
+        result = :result,
+        updated_at = :now,
+        processing_time = :now - COALESCE(updated_at, created_at)
+    WHERE id = :id
+    RETURNING processing_time, waiting_time
+"""
+SQL_SELECT_UNFINISHED = "SELECT id, priority FROM tasks WHERE status IN ('pending', 'processing') ORDER BY created_at"
+SQL_SELECT_PROCESSING = f"SELECT {TASK_COLUMNS} FROM tasks WHERE status = ?"
+# 已结束任务按状态沿idx_tasks_status_updated取数，附带rowid用于合并排序与键集分页
+SQL_SELECT_FINISHED_PAGE = f"""
+    SELECT {FINISHED_TASK_COLUMNS}, rowid FROM tasks WHERE status = ?
+    ORDER BY updated_at DESC, rowid LIMIT ?
+"""
+SQL_SELECT_FINISHED_AFTER = f"""
+    SELECT {FINISHED_TASK_COLUMNS}, rowid FROM tasks WHERE status = ? AND (updated_at, -rowid) < (?, ?)
+    ORDER BY updated_at DESC, rowid LIMIT ?
+"""
+# 游标缓存未命中时回退的OFFSET分页与总数查询，按状态过滤条件中的状态数量（1或2）各定义一条
+SQL_SELECT_FINISHED_OFFSET = {
+    n: f"""
+    SELECT {FINISHED_TASK_COLUMNS}, rowid FROM tasks WHERE status IN ({", ".join("?" * n)})
+    ORDER BY updated_at DESC, rowid LIMIT ? OFFSET ?
+"""
+    for n in (1, 2)
+}
+SQL_COUNT_FINISHED = {n: f"SELECT COUNT(*) FROM tasks WHERE status IN ({', '.join('?' * n)})" for n in (1, 2)}
+SQL_SELECT_CLEANUP = (
+    "SELECT rowid, audio_filepath FROM tasks"
+    " WHERE status IN (?, ?) AND created_at < ? AND audio_filepath IS NOT NULL"
+)
+SQL_CLEAR_AUDIO_PATH = "UPDATE tasks SET audio_filepath = NULL WHERE rowid = ?"
+SQL_PRUNE_STATS_BUCKETS = "DELETE FROM stats_buckets WHERE minute_epoch <= ?"
+SQL_SUM_STATS_BUCKETS = "SELECT SUM(count), SUM(sum_wait), SUM(sum_proc) FROM stats_buckets WHERE minute_epoch > ?"
+SQL_UPSERT_STATS_BUCKET = """
+    INSERT INTO stats_buckets (minute_epoch, count, sum_wait, sum_proc)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(minute_epoch) DO UPDATE SET
+        count = count + excluded.count,
+        sum_wait = sum_wait + excluded.sum_wait,
+        sum_proc = sum_proc + excluded.sum_proc
+"""
+
+# 默认的音频文件存储目录
 AUDIO_STORAGE_DIR = "audio_files"
-if not os.path.exists(AUDIO_STORAGE_DIR):
-    os.makedirs(AUDIO_STORAGE_DIR)
+
+
+def _heap_key(priority: int, seq: int) -> int:
+    """
+    把优先级和入队序号打包为一个整数排序键，堆比较只需整数比较。
+    修改为最大堆：优先级数值越大越优先，通过取负实现；同优先级按入队序号先进先出。
+    """
+    return (-priority << 32) | seq
+
+
+def _to_blob(task_id: str) -> bytes:
+    """将任务ID（UUID字符串）转换为数据库中存储的16字节BLOB，格式非法时抛出ValueError"""
+    return uuid.UUID(task_id).bytes
+
+
+def _to_str(task_id: bytes) -> str:
+    """将数据库中存储的16字节BLOB转换回任务ID（UUID字符串）"""
+    return str(uuid.UUID(bytes=task_id))
+
+
+def _task_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Task:
+    """行工厂：按TASK_COLUMNS的列顺序把数据库行直接构造为Task"""
+    return Task(
+        _to_str(row[0]),
+        row[1],
+        row[2],
+        TaskStatus(row[3]),
+        datetime.fromtimestamp(row[4]),
+        datetime.fromtimestamp(row[5]) if row[5] is not None else None,
+        row[6],
+        row[7],
+        row[8],
+    )
+
+
+def _history_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Tuple[Task, float, int]:
+    """行工厂：历史分页查询（FINISHED_TASK_COLUMNS后附加rowid），额外返回(updated_at, rowid)作为排序与游标键"""
+    return _task_row_factory(cursor, row), row[5], row[9]
+
+
+def _parse_history_cursor(cursor: str) -> Tuple[float, int]:
+    """解析历史分页游标"updated_at|rowid"，格式不正确时抛出ValueError"""
+    updated_at, sep, rowid = cursor.rpartition("|")
+    try:
+        if not sep:
+            raise ValueError
+        return float(updated_at), int(rowid)
+    except ValueError:
+        raise ValueError(f"无效的分页游标: {cursor}") from None
+
+
+def _unlink_if_exists(filepath: str) -> bool:
+    """删除文件，文件不存在时返回False（不预先stat）"""
+    try:
+        os.unlink(filepath)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+class _Withdrawal(Enum):
+    """撤回未持久化任务的结果"""
+    WITHDRAWN = "withdrawn"  # 已从缓冲区和内存队列中移除
+    COMMITTED = "committed"  # 任务记录已由其他刷新写入数据库
+    POPPED = "popped"  # 任务已被工作者取出，记录仍在缓冲区中等待写入
 
 
 class PriorityQueue:
     """
     一个持久化的、线程安全的优先级队列。
-    - 使用heapq实现内存中的优先级队列。
+    - 使用以任务ID索引的堆(IndexedHeap)实现内存中的优先级队列。
     - 使用SQLite进行任务的持久化存储。
     - 在启动时会从数据库加载未完成的任务。
-    - 使用事件标志实现高效的任务通知机制。
+    - 使用条件变量通知等待中的消费者，每次入队只唤醒一个等待者。
     """
 
-    def __init__(self, db_path="asr_queue.db"):
+    def __init__(self, db_path="asr_queue.db", audio_dir=AUDIO_STORAGE_DIR):
+        """
+        Args:
+            db_path (str): SQLite数据库文件路径
+            audio_dir (str): 上传音频文件的存储目录，不存在时自动创建
+        """
         self.db_path = db_path
-        self._queue = []  # 内存中的优先队列 (priority, created_at, task_id)
+        self.audio_dir = audio_dir
+        os.makedirs(audio_dir, exist_ok=True)
+        self._queue = IndexedHeap()  # 内存中的优先队列 (排序键, task_id)，以task_id索引
+        self._seq = itertools.count()  # 入队序号，作为同优先级任务的先后顺序
+        # 待处理任务的展示视图（按列存储id与优先级），随入队/出队增量维护
+        self._pending_ids: List[str] = []
+        self._pending_priorities: List[int] = []
         self._lock = threading.Lock()  # 线程锁，确保多线程操作安全
-        self._task_available = threading.Event()  # 新任务可用事件标志
-        init_db()  # 初始化数据库和表结构
+        self._cond = threading.Condition(self._lock)  # 新任务可用条件，与队列共用同一把锁
+        self._version = 0  # 状态版本号，任务入队、出队或状态变化时递增
+        self._listeners: List[Callable[[int], None]] = []  # 状态变化监听器
+        # 等待任务结束的事件: task_id -> (事件循环, asyncio.Event)
+        self._completion: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+        # 每个线程复用一个数据库连接，避免每次操作都重新打开连接并丢失页缓存
+        self._tls = threading.local()
+        self._connections: List[sqlite3.Connection] = []  # 所有已打开的连接，用于统一关闭
+        self._connections_lock = threading.Lock()
+        # 待写入数据库的新任务行，由后台线程批量提交
+        self._pending_inserts: deque = deque()
+        # 尚未提交到数据库的任务行（含正在写入的批次）: 任务ID的BLOB -> 行，提交后才移除，供get_task直接读取
+        self._unflushed: Dict[bytes, tuple] = {}
+        self._flush_event = threading.Event()  # 缓冲区有新行
+        self._flush_lock = threading.Lock()  # 串行化刷新，保证flush()返回时缓冲区中的行均已提交
+        self._flusher_stop = threading.Event()
+        # 历史分页缓存: 状态过滤条件 -> (缓存时间, 总数)；(状态过滤条件, 每页数量, 页码) -> (缓存时间, 游标)
+        self._history_count_cache: Dict[str, Tuple[float, int]] = {}
+        self._history_cursors: "OrderedDict[Tuple[str, int, int], Tuple[float, str]]" = OrderedDict()
+        init_db(db_path)  # 初始化数据库和表结构（同时启用WAL模式）
         self._load_pending_tasks()
+        self._flusher = threading.Thread(target=self._flush_loop, name="queue-flusher", daemon=True)
+        self._flusher.start()
+        # 初始化全部完成后再注册退出钩子，初始化失败的实例不会在退出时调用close()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        获取当前线程的数据库连接，首次调用时打开连接并应用连接级的PRAGMA设置。
+        - synchronous=NORMAL: WAL模式下提交时不再每次fsync，仅在检查点时同步。
+        - busy_timeout: 遇到写锁时等待而不是立即报错。
+        - temp_store=MEMORY: 排序等临时数据放在内存中。
+        - cache_size: 放大页缓存，连接长期复用时热点索引页常驻内存。
+        - wal_autocheckpoint: 固定WAL自动检查点的阈值，检查点为被动模式，不会阻塞提交。
+        - mmap_size: 通过内存映射读取数据库文件，历史查询等读多的操作少一次拷贝。
+        连接使用自动提交模式（isolation_level=None），多条语句的写操作显式使用BEGIN开启事务。
+        """
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
+            # 连接只在所属线程中使用，check_same_thread=False仅用于在close()中统一关闭
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=SQLITE_CACHED_STATEMENTS,
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KIB}")
+            conn.execute(f"PRAGMA wal_autocheckpoint={SQLITE_WAL_AUTOCHECKPOINT_PAGES}")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            conn.row_factory = sqlite3.Row  # 允许通过列名访问数据
+            self._tls.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """停止后台写入线程，写入缓冲区中剩余的任务后关闭所有线程打开的数据库连接。"""
+        self._flusher_stop.set()
+        self._flush_event.set()
+        if self._flusher.is_alive() and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self.flush()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def flush(self):
+        """
+        将缓冲区中的新任务写入数据库，每批最多INSERT_BATCH_SIZE行、一个事务。
+        更新刚入队任务的数据库记录前必须先调用，确保记录已存在；get_task直接读取尚未写入的缓冲行，无需调用。
+        """
+        with self._flush_lock:
+            while self._pending_inserts:
+                rows = []
+                while self._pending_inserts and len(rows) < INSERT_BATCH_SIZE:
+                    rows.append(self._pending_inserts.popleft())
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.execute("BEGIN IMMEDIATE")
+                        conn.executemany(SQL_INSERT_TASK, rows)
+                except sqlite3.Error:
+                    # 写入失败时放回缓冲区头部，等待下次刷新重试
+                    self._pending_inserts.extendleft(reversed(rows))
+                    raise
+                for row in rows:
+                    self._unflushed.pop(row[0], None)
+
+    def _flush_loop(self):
+        """后台写入线程：有新行时等待一个攒批间隔（缓冲区已满则立即写入），然后批量提交。"""
+        while not self._flusher_stop.is_set():
+            self._flush_event.wait()
+            self._flush_event.clear()
+            if len(self._pending_inserts) < INSERT_BATCH_SIZE:
+                self._flusher_stop.wait(INSERT_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"批量写入新任务失败: {e}")
+
+    def add_listener(self, callback: Callable[[int], None]):
+        """
+        注册状态变化监听器，每次版本号变化时以新版本号调用。
+        回调可能在任意线程中、持有队列锁时被调用，必须是非阻塞的。
+        """
+        self._listeners.append(callback)
+
+    def _bump_version(self):
+        """递增状态版本号并通知监听器，调用方需持有self._lock"""
+        self._version += 1
+        for callback in self._listeners:
+            callback(self._version)
 
     def _load_pending_tasks(self):
         """从数据库加载所有'pending'或'processing'状态的任务到内存队列中，以实现服务重启后的任务恢复。"""
         with self._lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
-            # 选取需要恢复的任务
-            cursor.execute(
-                "SELECT id, priority, created_at FROM tasks WHERE status IN ('pending', 'processing')"
+            # 选取需要恢复的任务，按创建时间排序以分配入队序号
+            cursor.execute(SQL_SELECT_UNFINISHED)
+            rows = cursor.fetchall()
+            self._pending_ids = [_to_str(row[0]) for row in rows]
+            self._pending_priorities = [row[1] for row in rows]
+            # 一次性建堆为O(n)，逐个入堆为O(n log n)
+            self._queue = IndexedHeap(
+                (_heap_key(priority, next(self._seq)), task_id)
+                for task_id, priority in zip(self._pending_ids, self._pending_priorities)
             )
-            for row in cursor.fetchall():
-                task_id, priority, created_at_str = row
-                created_at = datetime.fromisoformat(created_at_str)
-                # 修改为最大堆：优先级数值越大越优先
-                # 通过取负实现：用户优先级数值越大 -> 堆中数值越小
-                heapq.heappush(self._queue, (-priority, created_at, task_id))
-            conn.close()
             logger.info(f"从数据库加载了 {len(self._queue)} 个待处理任务。")
-            # 如果有待处理任务，设置事件标志
-            if self._queue:
-                self._task_available.set()
 
-    def push(self, audio_filepath: str, priority: int) -> str:  # 更改为audio_filepath
+    def push(self, audio_filepath: str, priority: int, durable: bool = False) -> str:  # 更改为audio_filepath
         """
         向队列中添加一个新任务，并将其持久化到数据库。
+        数据库写入默认由后台线程批量完成，本方法不访问数据库。
+        durable为True时等待任务记录提交后再返回；并发的持久化提交会在flush中合并为同一个事务。
+        持久化窗口：durable为False时，进程在返回后约INSERT_FLUSH_INTERVAL秒内崩溃会丢失该任务；
+        正常关闭时close()会写入缓冲区中的全部任务。synchronous=NORMAL下已提交的任务在进程崩溃后仍然保留，
+        只有操作系统崩溃或断电才可能丢失最近的提交。
         返回任务的唯一ID。
         """
-        with self._lock:
-            task_id = str(uuid.uuid4())
-            created_at = datetime.now()
+        task_uuid = uuid.uuid4()
+        task_id = str(task_uuid)
+        created_at = time.time()
 
-            # 1. 持久化到数据库
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO tasks (id, audio_filepath, priority, status, created_at) VALUES (?, ?, ?, ?, ?)",
-                (
-                    task_id,
-                    audio_filepath,
-                    priority,
-                    TaskStatus.PENDING.value,
-                    created_at,
-                ),
-            )
-            conn.commit()
-            conn.close()
+        # 1. 放入写入缓冲区，由后台线程批量持久化（需先于入堆，保证出队时flush能写入该行）
+        row = (task_uuid.bytes, audio_filepath, priority, TaskStatus.PENDING.value, created_at)
+        self._unflushed[task_uuid.bytes] = row
+        self._pending_inserts.append(row)
+        self._flush_event.set()
 
+        # 锁内只做内存队列操作
+        with self._lock:
             # 2. 推入内存队列
-            heapq.heappush(self._queue, (-priority, created_at, task_id))
-            
-            # 3. 通知工作线程有新任务可用
-            self._task_available.set()
+            self._queue.push((_heap_key(priority, next(self._seq)), task_id))
+            self._pending_ids.append(task_id)
+            self._pending_priorities.append(priority)
+            self._bump_version()
             
-            return task_id
+            # 3. 唤醒一个等待中的工作线程
+            self._cond.notify()
+
+        if durable:
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # 写入失败时撤回任务再报告失败，避免调用方收到错误而任务之后仍被执行
+                outcome = self._withdraw(task_id, row)
+                if outcome is _Withdrawal.WITHDRAWN:
+                    raise
+                if outcome is _Withdrawal.POPPED:
+                    logger.warning(f"任务 {task_id} 的持久化提交失败，但任务已被取出处理，将在出队时重试写入")
+                # COMMITTED: 其他刷新已提交该任务记录，持久化已经完成
+        return task_id
+
+    def _withdraw(self, task_id: str, row: tuple) -> _Withdrawal:
+        """
+        撤回尚未写入数据库的任务：从写入缓冲区、内存队列和待处理视图中移除。
+        任务记录已被其他刷新写入（COMMITTED）或任务已被工作者取出（POPPED）时不撤回。
+        """
+        # 持有_flush_lock期间缓冲区中的行不会被取走写入
+        with self._flush_lock:
+            try:
+                self._pending_inserts.remove(row)
+            except ValueError:
+                return _Withdrawal.COMMITTED
+            with self._lock:
+                if self._queue.remove(task_id) is None:
+                    # 已被工作者取出，保留该行，由出队时的flush重试写入
+                    self._pending_inserts.appendleft(row)
+                    return _Withdrawal.POPPED
+                del self._unflushed[row[0]]
+                index = self._pending_ids.index(task_id)
+                del self._pending_ids[index]
+                del self._pending_priorities[index]
+                self._bump_version()
+        return _Withdrawal.WITHDRAWN
 
     def pop(self) -> Optional[str]:
         """
@@ -98,127 +401,205 @@ class PriorityQueue:
         如果队列为空，返回None。
         """
         with self._lock:
-            if not self._queue:
-                # 队列为空时，清除事件标志
-                self._task_available.clear()
-                return None
-
-            priority, created_at, task_id = heapq.heappop(self._queue)
-
-            # 如果队列变空，清除事件标志
-            if not self._queue:
-                self._task_available.clear()
-
-            # 更新数据库中的任务状态
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            # 计算等待时间
-            waiting_time = (datetime.now() - created_at).total_seconds()
-            cursor.execute(
-                "UPDATE tasks SET status = ?, waiting_time = ? WHERE id = ?",
-                (TaskStatus.PROCESSING.value, waiting_time, task_id),
-            )
-            conn.commit()
-            conn.close()
+            popped = self._pop_locked()
+        return self._claim(popped)
 
-            return task_id
-
-    def wait_for_task(self, timeout=None):
+    def pop_blocking(self, timeout=None) -> Optional[str]:
         """
-        等待任务可用。使用事件标志实现高效的阻塞等待。
-        
+        阻塞直到有任务可出队，然后像pop()一样弹出任务。等待与出队在同一次持锁中完成，
+        被唤醒的线程不会被其他消费者抢走任务后空手而归。
+
         Args:
             timeout (float, optional): 超时时间（秒），None表示无限等待
-            
+
         Returns:
-            bool: True表示有任务可用，False表示超时
+            Optional[str]: 任务ID，超时或被wake_waiters()唤醒时队列为空则返回None
+        """
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            popped = self._pop_locked()
+        return self._claim(popped)
+
+    def _pop_locked(self) -> Optional[Tuple[Tuple[int, str], int, int]]:
+        """
+        从内存队列弹出优先级最高的任务，调用方需持有self._lock。
+        返回(堆条目, 在待处理视图中的位置, 优先级)，供标记失败时原样放回；队列为空时返回None。
+        """
+        if not self._queue:
+            return None
+        entry = self._queue.pop()
+        index = self._pending_ids.index(entry[1])
+        del self._pending_ids[index]
+        priority = self._pending_priorities.pop(index)
+        self._bump_version()
+        return entry, index, priority
+
+    def _claim(self, popped: Optional[Tuple[Tuple[int, str], int, int]]) -> Optional[str]:
+        """
+        将_pop_locked()弹出的任务标记为processing并返回任务ID。
+        标记失败（如数据库被锁）时把任务按原排序键放回内存队列和待处理视图，再重新抛出异常，
+        避免任务既不在队列中、数据库里又仍是pending。
         """
-        return self._task_available.wait(timeout)
+        if popped is None:
+            return None
+        entry, index, priority = popped
+        try:
+            self._mark_processing(entry[1])
+        except Exception:
+            with self._lock:
+                self._queue.push(entry)
+                self._pending_ids.insert(index, entry[1])
+                self._pending_priorities.insert(index, priority)
+                self._bump_version()
+                self._cond.notify()
+            raise
+        return entry[1]
+
+    def _mark_processing(self, task_id: str):
+        """在锁外更新数据库中的任务状态（先确保任务记录已写入），内存堆是出队顺序的唯一依据"""
+        self.flush()
+        conn = self._connect()
+        conn.execute(SQL_MARK_PROCESSING, (TaskStatus.PROCESSING.value, time.time(), _to_blob(task_id)))
+        # 出队时已递增过版本号，但那时数据库中的状态尚未更新；提交后再次递增，
+        # 确保监听者在任务变为processing之后还会收到一次通知
+        with self._lock:
+            self._bump_version()
+
+    def wake_waiters(self):
+        """唤醒所有在pop_blocking中等待的线程，使其能够快速检查停止条件"""
+        with self._cond:
+            self._cond.notify_all()
 
     def get_task(self, task_id: str) -> Optional[Task]:
-        """根据任务ID从数据库获取任务详情。"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row  # 允许通过列名访问数据
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-        row = cursor.fetchone()
-        conn.close()
-
-        if row:
-            # 将数据库行数据转换为Task数据类实例
-            return Task(
-                id=row["id"],
-                audio_filepath=row["audio_filepath"],
-                priority=row["priority"],
-                status=TaskStatus(row["status"]),
-                created_at=datetime.fromisoformat(row["created_at"]),
-                updated_at=(
-                    datetime.fromisoformat(row["updated_at"])
-                    if row["updated_at"]
-                    else None
-                ),
-                result=row["result"],
-                waiting_time=row["waiting_time"],
-                processing_time=row["processing_time"],
-            )
-        return None
+        """
+        根据任务ID获取任务详情。
+        尚未写入数据库的任务直接由缓冲的行构造（此时必为pending状态），只读数据库、从不等待写入，
+        可以在事件循环中调用。
+        """
+        try:
+            task_key = _to_blob(task_id)
+        except ValueError:
+            return None  # 不是合法的任务ID
+        row = self._unflushed.get(task_key)
+        if row is not None:
+            # 缓冲行为TASK_COLUMNS的前5列，其余列在写入时均为NULL
+            return _task_row_factory(None, row + (None, None, None, None))
+        cursor = self._connect().cursor()
+        cursor.row_factory = _task_row_factory
+        return cursor.execute(SQL_SELECT_TASK, (task_key,)).fetchone()
 
     def update_task_status(
-        self, task_id: str, status: TaskStatus, result: Optional[str] = None
+        self, task_id: str, status: TaskStatus, result: Optional[str] = None, finished_at: Optional[float] = None
     ):
-        """更新指定任务的状态和结果。"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        cursor = conn.cursor()
+        """
+        更新指定任务的状态和结果。
+        finished_at为状态实际变化的时间（time.time()），异步写入状态时由调用方传入，默认为当前时间。
+        返回本次计算出的处理时间（秒），任务不存在时返回None。
+        """
+        now = time.time() if finished_at is None else finished_at
+        conn = self._connect()
+        # 处理时间在SQL中计算，一条语句完成读取与更新
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                SQL_UPDATE_STATUS,
+                {"status": status.value, "result": result, "now": now, "id": _to_blob(task_id)},
+            ).fetchall()
+            row = rows[0] if rows else None
+            processing_time = row[0] if row else None
+            if row and status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                # 累加到当前分钟的统计桶，统计查询只需汇总最近若干个桶
+                waiting_time = row[1]
+                conn.execute(
+                    SQL_UPSERT_STATS_BUCKET,
+                    (
+                        int(now) // 60,
+                        1 if waiting_time is not None else 0,
+                        waiting_time or 0.0,
+                        processing_time - waiting_time
+                        if processing_time is not None and waiting_time is not None
+                        else 0.0,
+                    ),
+                )
+        with self._lock:
+            self._bump_version()
+            waiter = (
+                self._completion.pop(task_id, None)
+                if status in (TaskStatus.COMPLETED, TaskStatus.FAILED)
+                else None
+            )
+        if waiter:
+            # 调用方通常是工作者线程，需要线程安全地唤醒事件循环中的等待者
+            loop, event = waiter
+            loop.call_soon_threadsafe(event.set)
+        return processing_time
 
-        # 获取任务的创建时间或更新时间，用于计算处理时间
-        cursor.execute(
-            "SELECT created_at, updated_at FROM tasks WHERE id = ?", (task_id,)
-        )
-        row = cursor.fetchone()
-        processing_time = None
-        if row:
-            created_at = datetime.fromisoformat(row[0])
-            # 如果是第一次更新为processing，则updated_at是None，此时处理时间从created_at算起
-            # 否则从上一次updated_at算起
-            start_time = datetime.fromisoformat(row[1]) if row[1] else created_at
-            processing_time = (datetime.now() - start_time).total_seconds()
-
-        cursor.execute(
-            "UPDATE tasks SET status = ?, result = ?, updated_at = ?, processing_time = ? WHERE id = ?",
-            (status.value, result, datetime.now(), processing_time, task_id),
-        )
-        conn.commit()
-        conn.close()
+    async def wait_for(self, task_id: str, timeout: Optional[float] = None) -> bool:
+        """
+        异步等待任务结束（完成或失败）。
+
+        Args:
+            task_id (str): 任务ID
+            timeout (float, optional): 超时时间（秒），None表示无限等待
+
+        Returns:
+            bool: True表示任务已结束，False表示超时
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            _, event = self._completion.setdefault(task_id, (loop, asyncio.Event()))
+        # 注册事件后再检查一次状态，避免任务在注册前已经结束而错过通知
+        task = self.get_task(task_id)
+        if task and task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+            with self._lock:
+                self._completion.pop(task_id, None)
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._completion.pop(task_id, None)
+            return False
 
     def cleanup_old_audio_data(self, minutes: int = 30):
-        """清理指定分钟数之前的已完成或失败任务的音频数据，以节省空间。"""
-        cleanup_time = datetime.now() - timedelta(minutes=minutes)
+        """清理指定分钟数之前的已完成或失败任务的音频数据，以节省空间；同时删除过期的统计桶。"""
+        cleanup_time = time.time() - minutes * 60
         try:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
-            cursor = conn.cursor()
-            # 获取需要清理的旧任务的文件路径
-            cursor.execute(
-                "SELECT audio_filepath FROM tasks WHERE status IN (?, ?) AND created_at < ? AND audio_filepath IS NOT NULL",
-                (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, cleanup_time),
-            )
-            filepaths_to_delete = [row[0] for row in cursor.fetchall()]
-
-            # 删除文件系统中的音频文件
-            for filepath in filepaths_to_delete:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    logger.info(f"文件清理：删除了旧音频文件 {filepath}")
-
-            # 将数据库中的audio_filepath字段设置为空
-            cursor.execute(
-                "UPDATE tasks SET audio_filepath = NULL WHERE status IN (?, ?) AND created_at < ? AND audio_filepath IS NOT NULL",
-                (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, cleanup_time),
-            )
-            count = cursor.rowcount
-            conn.commit()
-            conn.close()
+            conn = self._connect()
+            # SQLite的RETURNING只能返回更新后的值，因此在同一个写事务中
+            # 先按条件做一次索引范围扫描取出rowid和路径，再按rowid逐行清空，不再用相同条件重复扫描
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    SQL_SELECT_CLEANUP,
+                    (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, cleanup_time),
+                ).fetchall()
+                conn.executemany(SQL_CLEAR_AUDIO_PATH, [(row[0],) for row in rows])
+                # 统计只读取最近的桶，顺带删除超出保留期的桶，避免每分钟一行无限增长
+                pruned = conn.execute(
+                    SQL_PRUNE_STATS_BUCKETS, (int(time.time()) // 60 - STATS_BUCKET_RETENTION_MINUTES,)
+                ).rowcount
+            filepaths_to_delete = [row[1] for row in rows]
+            count = len(filepaths_to_delete)
+
+            # 事务提交后再删除音频文件，避免持有写锁期间进行文件系统操作
+            if len(filepaths_to_delete) > UNLINK_PARALLEL_THRESHOLD:
+                # 文件较多时并发删除，使文件系统调用相互重叠
+                with ThreadPoolExecutor(max_workers=UNLINK_MAX_WORKERS) as executor:
+                    removed = list(executor.map(_unlink_if_exists, filepaths_to_delete))
+            else:
+                removed = [_unlink_if_exists(filepath) for filepath in filepaths_to_delete]
+            deleted = [filepath for filepath, ok in zip(filepaths_to_delete, removed) if ok]
+            if deleted:
+                logger.info(f"文件清理：删除了 {len(deleted)} 个旧音频文件")
+                logger.debug(f"文件清理：已删除 {deleted}")
+
             if count > 0:
                 logger.info(f"数据库清理：清除了 {count} 个旧任务的音频文件路径。")
+            if pruned > 0:
+                logger.info(f"数据库清理：删除了 {pruned} 个过期的统计桶。")
         except Exception as e:
             logger.error(f"数据库清理时出错: {e}")
 
@@ -228,184 +609,177 @@ class PriorityQueue:
         with self._lock:
             return len(self._queue)
 
+    def get_pending_view(self) -> dict:
+        """返回待处理任务的展示视图（按列组织的id与优先级），无需遍历内部堆结构。"""
+        with self._lock:
+            return {"id": list(self._pending_ids), "priority": list(self._pending_priorities)}
+
+    @property
+    def version(self) -> int:
+        """返回当前状态版本号，版本号不变说明队列及任务状态均未变化。"""
+        return self._version
+
     def get_recent_tasks(self, limit: int = 10) -> List[Task]:
         """获取最近完成或失败的任务列表。"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM tasks WHERE status IN (?, ?) ORDER BY updated_at DESC LIMIT ?",
-            (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, limit),
-        )
-        rows = cursor.fetchall()
-        conn.close()
-
-        recent_tasks = []
-        for row in rows:
-            recent_tasks.append(
-                Task(
-                    id=row["id"],
-                    audio_filepath=row["audio_filepath"],
-                    priority=row["priority"],
-                    status=TaskStatus(row["status"]),
-                    created_at=datetime.fromisoformat(row["created_at"]),
-                    updated_at=(
-                        datetime.fromisoformat(row["updated_at"])
-                        if row["updated_at"]
-                        else None
-                    ),
-                    result=row["result"],
-                    waiting_time=row["waiting_time"],
-                    processing_time=row["processing_time"] - row["waiting_time"],
-                )
-            )
-        return recent_tasks
+        cursor = self._connect().cursor()
+        cursor.row_factory = _history_row_factory
+        # 对 status IN (...) 按updated_at排序需要额外排序整个结果集；
+        # 改为每个状态各自沿idx_tasks_status_updated取前limit条，再合并
+        rows = []
+        for status in (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value):
+            rows.extend(cursor.execute(SQL_SELECT_FINISHED_PAGE, (status, limit)).fetchall())
+        rows.sort(key=lambda row: (row[1], -row[2]), reverse=True)
+        return [row[0] for row in rows[:limit]]
 
     def get_processing_tasks(self) -> List[Task]:
         """获取所有'processing'状态的任务列表。"""
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM tasks WHERE status = ?", (TaskStatus.PROCESSING.value,)
-        )
-        rows = cursor.fetchall()
-        conn.close()
-
-        processing_tasks = []
-        for row in rows:
-            processing_tasks.append(
-                Task(
-                    id=row["id"],
-                    audio_filepath=row["audio_filepath"],
-                    priority=row["priority"],
-                    status=TaskStatus(row["status"]),
-                    created_at=datetime.fromisoformat(row["created_at"]),
-                    updated_at=(
-                        datetime.fromisoformat(row["updated_at"])
-                        if row["updated_at"]
-                        else None
-                    ),
-                    result=row["result"],
-                    waiting_time=row["waiting_time"],
-                    processing_time=row["processing_time"],
-                )
-            )
-        return processing_tasks
+        cursor = self._connect().cursor()
+        cursor.row_factory = _task_row_factory
+        return cursor.execute(SQL_SELECT_PROCESSING, (TaskStatus.PROCESSING.value,)).fetchall()
 
     def calculate_statistics(self, interval_minutes: int, worker_count: int = 1):
         """计算指定时间区间内的平均等待时间和负载
         :param interval_minutes: 时间区间（分钟）
         :param worker_count: 工作线程数量，用于计算负载
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        conn = self._connect()
+        cursor = conn.cursor()
 
-            # 使用SQLite的datetime函数处理时间范围
-            cursor.execute(
-                """
-            SELECT
-                AVG(waiting_time),
-                SUM(processing_time - waiting_time)
-            FROM
-                tasks
-            WHERE
-                status IN ('completed', 'failed')
-              AND datetime(updated_at) >= datetime('now', ?, 'localtime');
-                """,
-                (f"-{interval_minutes} minutes",),
-            )
-            result = cursor.fetchone()
-            avg_waiting_time = result[0] or 0.0
-            total_processing_time = result[1] or 0.0
-
-            # 计算负载 = 总处理时间 / (时间区间 * 工作线程数)
-            total_seconds = interval_minutes * 60 * worker_count
-            avg_load = (
-                (total_processing_time / total_seconds) * 100
-                if total_seconds > 0
-                else 0.0
-            )
+        # 汇总最近interval_minutes个分钟统计桶（含当前分钟），与任务总量无关
+        cursor.execute(SQL_SUM_STATS_BUCKETS, (int(time.time()) // 60 - interval_minutes,))
+        count, sum_wait, sum_proc = cursor.fetchone()
+        avg_waiting_time = sum_wait / count if count else 0.0
+        total_processing_time = sum_proc or 0.0
+
+        # 计算负载 = 总处理时间 / (时间区间 * 工作线程数)
+        total_seconds = interval_minutes * 60 * worker_count
+        avg_load = (
+            (total_processing_time / total_seconds) * 100
+            if total_seconds > 0
+            else 0.0
+        )
 
         return round(avg_waiting_time, 2), round(avg_load, 2)
 
-    def get_history_tasks(self, page: int = 1, page_size: int = 50, status_filter: Optional[str] = None) -> dict:
+    def _history_count(self, conn: sqlite3.Connection, status_filter: str, statuses: List[str]) -> int:
+        """历史任务总数，按状态过滤条件缓存HISTORY_COUNT_TTL秒，避免每次翻页都执行COUNT扫描"""
+        now = time.monotonic()
+        cached = self._history_count_cache.get(status_filter)
+        if cached and now - cached[0] < HISTORY_COUNT_TTL:
+            return cached[1]
+        total_count = conn.execute(SQL_COUNT_FINISHED[len(statuses)], statuses).fetchone()[0]
+        self._history_count_cache[status_filter] = (now, total_count)
+        return total_count
+
+    def _page_cursor(self, key: Tuple[str, int, int]) -> Optional[str]:
+        """查找页码对应的游标，超过HISTORY_COUNT_TTL秒的游标视为过期"""
+        entry = self._history_cursors.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= HISTORY_COUNT_TTL:
+            del self._history_cursors[key]
+            return None
+        self._history_cursors.move_to_end(key)
+        return entry[1]
+
+    def _remember_cursor(self, key: Tuple[str, int, int], cursor: str):
+        """记录页码对应的游标，超出容量时淘汰最久未使用的条目"""
+        self._history_cursors[key] = (time.monotonic(), cursor)
+        self._history_cursors.move_to_end(key)
+        while len(self._history_cursors) > HISTORY_CURSOR_CACHE_SIZE:
+            self._history_cursors.popitem(last=False)
+
+    def get_history_tasks(
+        self,
+        page: int = 1,
+        page_size: int = 50,
+        status_filter: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> dict:
         """获取历史任务列表，支持分页和状态过滤
+        使用键集分页（updated_at, rowid）代替OFFSET；按页码访问时通过页码->游标的缓存定位，
+        缓存未命中时才退化为OFFSET查询。
         :param page: 页码，从1开始
         :param page_size: 每页任务数量
         :param status_filter: 状态过滤，可选值：'completed', 'failed', 'all'
-        :return: 包含任务列表、总数等信息的字典
+        :param cursor: 上一页返回的next_cursor，提供时从该位置继续查询
+        :return: 包含任务列表、总数、下一页游标等信息的字典；cursor模式下total_pages、current_page、has_prev为None
+        :raises ValueError: cursor格式不正确
         """
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # 构建查询条件
-        where_conditions = []
-        params = []
-        
-        if status_filter and status_filter != 'all':
-            if status_filter == 'completed':
-                where_conditions.append("status = ?")
-                params.append(TaskStatus.COMPLETED.value)
-            elif status_filter == 'failed':
-                where_conditions.append("status = ?")
-                params.append(TaskStatus.FAILED.value)
+        # 游标模式下page不表示实际位置，返回的游标不能记入页码->游标缓存
+        page_addressed = cursor is None
+        position = _parse_history_cursor(cursor) if cursor is not None else None
+        conn = self._connect()
+
+        if status_filter == 'completed':
+            statuses = [TaskStatus.COMPLETED.value]
+        elif status_filter == 'failed':
+            statuses = [TaskStatus.FAILED.value]
         else:
             # 默认显示已完成或失败的任务
-            where_conditions.append("status IN (?, ?)")
-            params.extend([TaskStatus.COMPLETED.value, TaskStatus.FAILED.value])
-        
-        where_clause = "WHERE " + " AND ".join(where_conditions) if where_conditions else ""
-        
-        # 查询总数
-        count_query = f"SELECT COUNT(*) FROM tasks {where_clause}"
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()[0]
-        
-        # 查询数据
-        offset = (page - 1) * page_size
-        data_query = f"""
-            SELECT * FROM tasks {where_clause} 
-            ORDER BY updated_at DESC 
-            LIMIT ? OFFSET ?
-        """
-        cursor.execute(data_query, params + [page_size, offset])
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # 构建任务列表
-        tasks = []
-        for row in rows:
-            tasks.append(
-                Task(
-                    id=row["id"],
-                    audio_filepath=row["audio_filepath"],
-                    priority=row["priority"],
-                    status=TaskStatus(row["status"]),
-                    created_at=datetime.fromisoformat(row["created_at"]),
-                    updated_at=(
-                        datetime.fromisoformat(row["updated_at"])
-                        if row["updated_at"]
-                        else None
-                    ),
-                    result=row["result"],
-                    waiting_time=row["waiting_time"],
-                    processing_time=row["processing_time"] - row["waiting_time"] if row["processing_time"] and row["waiting_time"] else None,
-                )
-            )
-        
-        # 计算分页信息
-        total_pages = (total_count + page_size - 1) // page_size
-        has_next = page < total_pages
-        has_prev = page > 1
-        
+            status_filter = 'all'
+            statuses = [TaskStatus.COMPLETED.value, TaskStatus.FAILED.value]
+
+        # 查询总数（带缓存）
+        total_count = self._history_count(conn, status_filter, statuses)
+
+        if position is None and page > 1:
+            cached_cursor = self._page_cursor((status_filter, page_size, page))
+            if cached_cursor is not None:
+                position = _parse_history_cursor(cached_cursor)
+
+        # 行为 (Task, updated_at, rowid)；多取一行用于判断是否还有下一页
+        limit = page_size + 1
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = _history_row_factory
+        if position is not None or page == 1:
+            # 键集分页：每个状态各自沿索引取一页再合并，避免对IN条件的结果整体排序
+            rows = []
+            for status in statuses:
+                if position is None:
+                    rows.extend(db_cursor.execute(SQL_SELECT_FINISHED_PAGE, (status, limit)).fetchall())
+                else:
+                    updated_at, rowid = position
+                    rows.extend(db_cursor.execute(
+                        SQL_SELECT_FINISHED_AFTER,
+                        (status, updated_at, -rowid, limit),
+                    ).fetchall())
+            rows.sort(key=lambda row: (row[1], -row[2]), reverse=True)
+            del rows[limit:]
+        else:
+            rows = db_cursor.execute(
+                SQL_SELECT_FINISHED_OFFSET[len(statuses)],
+                statuses + [limit, (page - 1) * page_size],
+            ).fetchall()
+
+        # 只有确实存在下一页时才返回游标，恰好取满的最后一页不返回
+        next_cursor = None
+        if len(rows) > page_size:
+            del rows[page_size:]
+            _, updated_at, rowid = rows[-1]
+            next_cursor = f"{updated_at}|{rowid}"
+            if page_addressed:
+                self._remember_cursor((status_filter, page_size, page + 1), next_cursor)
+
+        tasks = [row[0] for row in rows]
+
+        # 计算分页信息；游标模式下无法得知所在页码，页码相关字段返回None
+        if page_addressed:
+            total_pages = (total_count + page_size - 1) // page_size
+            current_page = page
+            has_next = page < total_pages
+            has_prev = page > 1
+        else:
+            total_pages = current_page = has_prev = None
+            has_next = next_cursor is not None
+
         return {
             "tasks": tasks,
             "total_count": total_count,
             "total_pages": total_pages,
-            "current_page": page,
+            "current_page": current_page,
             "page_size": page_size,
             "has_next": has_next,
-            "has_prev": has_prev
+            "has_prev": has_prev,
+            "next_cursor": next_cursor,
         }
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from task_queue.dispatcher import TaskDispatcher
+from task_queue.priority_queue import PriorityQueue
+
+
+@pytest.fixture
+def queue():
+    with tempfile.TemporaryDirectory() as path:
+        queue = PriorityQueue(
+            db_path=os.path.join(path, "asr_queue.db"),
+            audio_dir=os.path.join(path, "audio_files"),
+        )
+        yield queue
+        queue.close()
+
+
+@pytest.fixture
+def dispatcher(queue):
+    dispatcher = TaskDispatcher(queue, worker_count=1)
+    yield dispatcher
+    dispatcher.stop()
+    dispatcher.join(timeout=5)
+
+
+def test_dispatcher_survives_pop_failure(queue, dispatcher, monkeypatch):
+    failed = threading.Event()
+    mark_processing = queue._mark_processing
+
+    def fail_once(task_id):
+        if not failed.is_set():
+            failed.set()
+            raise sqlite3.OperationalError("database is locked")
+        mark_processing(task_id)
+
+    monkeypatch.setattr(queue, "_mark_processing", fail_once)
+    first = queue.push("first.wav", 10)
+    dispatcher.start()
+    assert failed.wait(timeout=5)
+
+    second = queue.push("second.wav", 10)
+    taken = []
+    while second not in taken:
+        task_id = dispatcher.take(0, timeout=5)
+        assert task_id is not None
+        assert task_id in (first, second)
+        taken.append(task_id)
+        dispatcher.done(0)
+    assert dispatcher.is_alive()
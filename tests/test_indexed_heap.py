@@ -0,0 +1,43 @@
+import pytest
+
+from task_queue.indexed_heap import IndexedHeap
+
+
+def test_pop_in_key_order():
+    heap = IndexedHeap([(3, "c"), (1, "a")])
+    heap.push((2, "b"))
+    assert len(heap) == 3
+    assert heap.peek() == (1, "a")
+    assert [heap.pop() for _ in range(3)] == [(1, "a"), (2, "b"), (3, "c")]
+    assert not heap
+    assert heap.peek() is None
+    with pytest.raises(IndexError):
+        heap.pop()
+
+
+def test_remove_and_update():
+    heap = IndexedHeap([(1, "a"), (2, "b"), (3, "c")])
+    assert heap.remove("a") == (1, "a")
+    assert heap.remove("missing") is None
+    assert "a" not in heap
+    heap.update((0, "c"))
+    with pytest.raises(KeyError):
+        heap.update((0, "missing"))
+    assert [heap.pop() for _ in range(2)] == [(0, "c"), (2, "b")]
+
+
+def test_push_existing_key_replaces_entry():
+    heap = IndexedHeap()
+    heap.push((5, "a"))
+    heap.push((1, "a"))
+    assert len(heap) == 1
+    assert heap.pop() == (1, "a")
+    assert not heap
+
+
+def test_stale_entries_are_compacted():
+    heap = IndexedHeap((i, i) for i in range(1000))
+    for i in range(0, 1000, 2):
+        heap.remove(i)
+    assert len(heap._heap) <= 2 * len(heap) + 64
+    assert [heap.pop()[1] for _ in range(len(heap))] == list(range(1, 1000, 2))
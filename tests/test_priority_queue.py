@@ -0,0 +1,330 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import SCHEMA_VERSION, TaskStatus
+from task_queue.priority_queue import PriorityQueue
+
+
+@pytest.fixture
+def workdir():
+    """每个测试使用独立的临时目录存放数据库和音频文件"""
+    with tempfile.TemporaryDirectory() as path:
+        yield path
+
+
+@pytest.fixture
+def make_queue(workdir):
+    """创建指向同一数据库的队列实例（用于模拟重启），测试结束时全部关闭"""
+    queues = []
+
+    def factory():
+        queue = PriorityQueue(
+            db_path=os.path.join(workdir, "asr_queue.db"),
+            audio_dir=os.path.join(workdir, "audio_files"),
+        )
+        queues.append(queue)
+        return queue
+
+    yield factory
+    for queue in queues:
+        queue.close()
+
+
+@pytest.fixture
+def queue(make_queue):
+    return make_queue()
+
+
+def _finish(queue, count, finished_at, status=TaskStatus.COMPLETED):
+    """入队count个任务并依次出队、结束，finished_at(i)给出第i个任务的结束时间，返回任务ID列表"""
+    task_ids = [queue.push(f"audio_{i}.wav", 10) for i in range(count)]
+    for i, task_id in enumerate(task_ids):
+        assert queue.pop() == task_id
+        queue.update_task_status(task_id, status, f"result {i}", finished_at(i))
+    return task_ids
+
+
+def test_pop_order_by_priority_then_fifo(queue):
+    low = queue.push("low.wav", 1)
+    high_first = queue.push("high_1.wav", 5)
+    high_second = queue.push("high_2.wav", 5)
+    middle = queue.push("middle.wav", 3)
+
+    assert queue.size == 4
+    assert sorted(queue.get_pending_view()["id"]) == sorted([low, high_first, high_second, middle])
+    assert [queue.pop() for _ in range(4)] == [high_first, high_second, middle, low]
+    assert queue.pop() is None
+    assert queue.get_pending_view() == {"id": [], "priority": []}
+    assert queue.get_task(high_first).status == TaskStatus.PROCESSING
+
+
+def test_get_task_sees_buffered_and_unknown_ids(queue):
+    task_id = queue.push("a.wav", 7)
+    task = queue.get_task(task_id)
+    assert task.id == task_id
+    assert task.status == TaskStatus.PENDING
+    assert task.priority == 7
+    assert task.audio_filepath == "a.wav"
+
+    queue.flush()
+    assert queue.get_task(task_id) == task
+    assert queue.get_task(str(uuid.uuid4())) is None
+    assert queue.get_task("not-a-uuid") is None
+
+
+def test_pop_blocking_waits_for_push(queue):
+    assert queue.pop_blocking(timeout=0.05) is None
+
+    pushed = []
+    timer = threading.Timer(0.05, lambda: pushed.append(queue.push("late.wav", 1)))
+    timer.start()
+    task_id = queue.pop_blocking(timeout=5)
+    timer.join()
+    assert task_id == pushed[0]
+
+
+def test_failed_mark_processing_requeues_task(queue, monkeypatch):
+    first = queue.push("first.wav", 5)
+    second = queue.push("second.wav", 1)
+    view = queue.get_pending_view()
+
+    def fail(task_id):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(queue, "_mark_processing", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        queue.pop()
+    with pytest.raises(sqlite3.OperationalError):
+        queue.pop_blocking(timeout=0.05)
+    assert queue.size == 2
+    assert queue.get_pending_view() == view
+
+    monkeypatch.undo()
+    assert [queue.pop(), queue.pop()] == [first, second]
+    assert queue.get_task(first).status == TaskStatus.PROCESSING
+
+
+def test_durable_push_is_committed_before_returning(queue):
+    task_id = queue.push("durable.wav", 1, durable=True)
+    with sqlite3.connect(queue.db_path) as conn:
+        row = conn.execute("SELECT status FROM tasks WHERE id = ?", (uuid.UUID(task_id).bytes,)).fetchone()
+    assert row == (TaskStatus.PENDING.value,)
+
+
+def test_failed_durable_push_outcomes(queue, monkeypatch, caplog):
+    flush = queue.flush
+
+    def warnings():
+        # 后台刷新线程的失败会记录ERROR日志，这里只关心push的告警
+        return [record.getMessage() for record in caplog.records if record.levelname == "WARNING"]
+
+    def fail():
+        raise sqlite3.OperationalError("disk I/O error")
+
+    # 写入失败且任务仍在队列中：撤回并报错
+    monkeypatch.setattr(queue, "flush", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        queue.push("withdrawn.wav", 1, durable=True)
+    assert queue.size == 0
+    assert not queue._unflushed
+
+    # 其他刷新已提交该任务：视为成功，不告警
+    def committed_then_fail():
+        flush()
+        fail()
+
+    monkeypatch.setattr(queue, "flush", committed_then_fail)
+    committed = queue.push("committed.wav", 1, durable=True)
+    assert queue.size == 1
+    assert not warnings()
+
+    # 任务已被取出：不撤回，只告警（只在push所在线程中模拟工作者出队，后台刷新线程不出队）
+    pushing_thread = threading.current_thread()
+
+    def popped_then_fail():
+        if threading.current_thread() is pushing_thread:
+            with queue._lock:
+                queue._pop_locked()
+        fail()
+
+    monkeypatch.setattr(queue, "flush", popped_then_fail)
+    popped = queue.push("popped.wav", 9, durable=True)
+    assert len(warnings()) == 1 and popped in warnings()[0]
+
+    monkeypatch.undo()
+    queue.flush()
+    assert queue.get_task(committed).status == TaskStatus.PENDING
+    assert queue.get_task(popped).audio_filepath == "popped.wav"
+
+
+def test_close_flushes_buffered_inserts(queue):
+    for i in range(1200):
+        queue.push(f"audio_{i}.wav", i % 3)
+    queue.close()
+    with sqlite3.connect(queue.db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 1200
+
+
+def test_restart_recovers_unfinished_tasks(make_queue):
+    queue = make_queue()
+    low = queue.push("low.wav", 1)
+    high = queue.push("high.wav", 9)
+    middle = queue.push("middle.wav", 5)
+    done = queue.push("done.wav", 5)
+    assert queue.pop() == high  # 处理中的任务重启后也需要重新执行
+    queue.update_task_status(done, TaskStatus.COMPLETED, "ok")
+    queue.close()
+
+    restarted = make_queue()
+    assert restarted.size == 3
+    assert [restarted.pop() for _ in range(3)] == [high, middle, low]
+    assert restarted.get_task(done).status == TaskStatus.COMPLETED
+
+
+def test_update_task_status_records_times_and_statistics(queue):
+    task_id = queue.push("a.wav", 1)
+    assert queue.pop() == task_id
+    finished_at = time.time() + 2
+    processing_time = queue.update_task_status(task_id, TaskStatus.COMPLETED, "text", finished_at)
+
+    task = queue.get_task(task_id)
+    assert task.status == TaskStatus.COMPLETED
+    assert task.result == "text"
+    assert processing_time == pytest.approx(2, abs=0.5)
+    assert task.processing_time == processing_time
+    # 历史列表展示的处理时间扣除了等待时间
+    finished = queue.get_history_tasks()["tasks"][0]
+    assert finished.processing_time == pytest.approx(processing_time - task.waiting_time)
+    avg_waiting_time, _ = queue.calculate_statistics(5)
+    assert avg_waiting_time == round(task.waiting_time, 2)
+    assert queue.update_task_status(str(uuid.uuid4()), TaskStatus.FAILED, "missing") is None
+
+
+def test_migration_from_baseline_db(make_queue, workdir):
+    """旧版数据库：TEXT主键、本地时间字符串时间戳、没有user_version"""
+    created = datetime.now().replace(microsecond=123456) - timedelta(minutes=5)
+    pending_id, done_id = str(uuid.uuid4()), str(uuid.uuid4())
+    with sqlite3.connect(os.path.join(workdir, "asr_queue.db")) as conn:
+        conn.execute('''
+            CREATE TABLE tasks (
+                id TEXT PRIMARY KEY,
+                audio_filepath TEXT,
+                priority INTEGER DEFAULT 0,
+                status TEXT CHECK(status IN ('pending', 'processing', 'completed', 'failed')),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP,
+                result TEXT,
+                waiting_time REAL,
+                processing_time REAL
+            )
+        ''')
+        conn.execute(
+            "INSERT INTO tasks (id, audio_filepath, priority, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (pending_id, "pending.wav", 3, "pending", str(created)),
+        )
+        conn.execute(
+            "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (done_id, None, 1, "completed", str(created), str(created + timedelta(seconds=30)), "ok", 10.0, 30.0),
+        )
+
+    queue = make_queue()
+    assert queue.size == 1
+    pending = queue.get_task(pending_id)
+    # julianday换算只保证毫秒级精度
+    assert abs(pending.created_at - created) < timedelta(milliseconds=1)
+    done = queue.get_task(done_id)
+    assert abs(done.updated_at - (created + timedelta(seconds=30))) < timedelta(milliseconds=1)
+    assert queue.get_history_tasks()["tasks"][0].id == done_id
+    assert queue.pop() == pending_id
+
+    with sqlite3.connect(queue.db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT DISTINCT typeof(id), typeof(created_at) FROM tasks").fetchall() == [
+            ("blob", "real")
+        ]
+
+
+@pytest.fixture
+def history_queue(queue):
+    """25个已结束任务，结束时间两两相同，用于检验同一时间戳下按rowid排序"""
+    task_ids = _finish(queue, 25, lambda i: 1000.0 + i // 2)
+    # 期望顺序：updated_at降序，相同时按插入顺序（rowid升序）
+    expected = sorted(range(25), key=lambda i: (-(i // 2), i))
+    return queue, [task_ids[i] for i in expected]
+
+
+def _ids(result):
+    return [task.id for task in result["tasks"]]
+
+
+def test_history_pages_by_number(history_queue):
+    queue, expected = history_queue
+    pages = [queue.get_history_tasks(page, 4) for page in range(1, 8)]
+    assert sum((_ids(page) for page in pages), []) == expected
+    assert pages[0]["total_count"] == 25
+    assert pages[0]["total_pages"] == 7
+    assert not pages[-1]["has_next"]
+    # 未缓存游标的页码走OFFSET回退，结果一致
+    queue._history_cursors.clear()
+    assert _ids(queue.get_history_tasks(5, 4)) == expected[16:20]
+
+
+def test_history_pages_by_cursor(history_queue):
+    queue, expected = history_queue
+    collected, cursor = [], None
+    while True:
+        result = queue.get_history_tasks(page_size=4, cursor=cursor)
+        collected += _ids(result)
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert collected == expected
+
+
+def test_history_cursor_mode_has_no_page_numbers(history_queue):
+    queue, expected = history_queue
+    # 25个任务每页5个，最后一页恰好取满，不应再返回游标
+    first = queue.get_history_tasks(page_size=5)
+    assert first["has_next"] and first["current_page"] == 1
+    results, cursor = [], first["next_cursor"]
+    while cursor is not None:
+        results.append(queue.get_history_tasks(page=9, page_size=5, cursor=cursor))
+        cursor = results[-1]["next_cursor"]
+    assert sum((_ids(result) for result in [first] + results), []) == expected
+    assert len(results[-1]["tasks"]) == 5
+    assert not results[-1]["has_next"]
+    assert all(result["has_next"] for result in results[:-1])
+    for result in results:
+        assert result["current_page"] is None
+        assert result["total_pages"] is None
+        assert result["has_prev"] is None
+    assert queue.get_history_tasks(5, 5)["next_cursor"] is None
+
+
+def test_cursor_requests_do_not_corrupt_page_cache(history_queue):
+    queue, expected = history_queue
+    first = queue.get_history_tasks(1, 2)
+    second = queue.get_history_tasks(1, 2, cursor=first["next_cursor"])
+    queue.get_history_tasks(1, 2, cursor=second["next_cursor"])
+    assert _ids(queue.get_history_tasks(2, 2)) == expected[2:4]
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "a|b", "1.0|", "|3"])
+def test_malformed_cursor_raises(queue, cursor):
+    with pytest.raises(ValueError):
+        queue.get_history_tasks(cursor=cursor)
+
+
+def test_history_status_filter(queue):
+    completed = _finish(queue, 3, lambda i: 1000.0 + i)
+    failed = _finish(queue, 2, lambda i: 2000.0 + i, TaskStatus.FAILED)
+    assert _ids(queue.get_history_tasks(status_filter="failed")) == failed[::-1]
+    assert _ids(queue.get_history_tasks(status_filter="completed")) == completed[::-1]
+    assert queue.get_history_tasks(status_filter="all")["total_count"] == 5
@@ -0,0 +1,34 @@
+import librosa
+import soundfile as sf
+
+
+def iter_audio_slices(audio_path, slice_duration, sample_rate=16000):
+    """
+    按片解码音频文件，逐片产出单声道、指定采样率的音频数据
+    - 使用soundfile按块读取，第一片可以在整个文件解码完成前开始识别，内存占用与片长成正比。
+    - 采样率不一致时逐片重采样。
+    - soundfile无法读取的格式回退为librosa整体解码后再分片。
+
+    Args:
+        audio_path (str): 音频文件路径
+        slice_duration (int): 每片音频的时长（秒）
+        sample_rate (int): 输出采样率
+
+    Yields:
+        np.ndarray: float32音频片
+    """
+    try:
+        orig_sr = sf.info(audio_path).samplerate
+    except RuntimeError:
+        speech, _ = librosa.load(audio_path, sr=sample_rate)
+        slice_samples = int(slice_duration * sample_rate)
+        for i in range(0, len(speech), slice_samples):
+            yield speech[i:i + slice_samples]
+        return
+
+    for block in sf.blocks(audio_path, blocksize=int(slice_duration * orig_sr), dtype="float32", always_2d=True):
+        # 多声道取平均混为单声道，与librosa.load(mono=True)一致
+        block = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        if orig_sr != sample_rate:
+            block = librosa.resample(block, orig_sr=orig_sr, target_sr=sample_rate)
+        yield block
@@ -1,4 +1,5 @@
-import json
+import orjson
+from uvicorn.server import logger
 
 
 
@@ -13,11 +14,8 @@ def merge_by_speaker(data, max_gap_seconds=2.0) -> list:
     返回:
     merged: 合并后的文本列表
     """
-    if isinstance(data, str):
-        try:
-            data = json.loads(data)
-        except:
-            data = eval(data)
+    if isinstance(data, (str, bytes)):
+        data = orjson.loads(data)
     
     sentence_info = data.get("sentence_info", [])
     if not sentence_info:
@@ -65,20 +63,20 @@ def merge_by_speaker(data, max_gap_seconds=2.0) -> list:
     return merged
 
 
-def load_json(content:str) -> dict:
+def load_json(content) -> dict:
     """
-    尝试将字符串内容解析为JSON对象。
+    尝试将JSON字符串或模型输出解析为字典对象。
     
     参数:
-    content: 字符串内容
+    content: JSON字符串，或模型generate直接返回的列表/字典
     
     返回:
     dict: 解析后的字典对象
     """
     try:
-        data_list = eval(content)
+        data_list = orjson.loads(content) if isinstance(content, (str, bytes)) else content
         # 数据是一个列表，取第一个元素
         return data_list[0] if isinstance(data_list, list) else data_list
     except Exception as e:
-        print(f"解析数据时出错: {e}")
+        logger.warning("解析数据时出错: %s", e)
         return {}
\ No newline at end of file
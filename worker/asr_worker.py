@@ -1,21 +1,30 @@
-import sys
 import os
-# 将项目根目录添加到Python路径中，以解决模块导入问题
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 import time
 import threading
 import torch
-import tempfile
-import librosa
-from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
-from task_queue.priority_queue import PriorityQueue, AUDIO_STORAGE_DIR
-from models import TaskStatus, Task # 导入Task模型
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from task_queue.priority_queue import PriorityQueue
+from task_queue.dispatcher import TaskDispatcher
+from models import TaskStatus
 from uvicorn.server import logger
-from util.res_format import merge_by_speaker, load_json
+from util.audio import iter_audio_slices
+from worker.model_cache import load_model
+
+def _recognize_batch(model, slices):
+    """对一批音频片进行一次批量推理，按顺序产出每片的识别文本"""
+    res = model.generate(
+        input=slices,
+        language="auto",  # "zn", "en", "yue", "ja", "ko", "nospeech"
+        use_itn=True,
+        disable_pbar=True
+    )
+    for r in res or []:
+        if r["text"]:
+            yield rich_transcription_postprocess(r["text"])
 
-def quasi_streaming_recognition(audio_path, model=None, slice_duration=15, device="cuda:0"):
+def quasi_streaming_recognition(audio_path, model=None, slice_duration=15, device="cuda:0", batch_size=4):
     """
     准流式识别音频文件
     
@@ -24,13 +33,14 @@ def quasi_streaming_recognition(audio_path, model=None, slice_duration=15, devic
         model (AutoModel, optional): 预加载的模型实例
         slice_duration (int): 每片音频的时长（秒）
         device (str): 设备类型 ("cuda:0", "cuda:1" 或 "cpu")
+        batch_size (int): 每次批量推理的音频片数，越小首个结果返回越快
         
     Yields:
         str: 每个片段的识别文本
     """
     # 加载模型
     if model is None:
-        model = AutoModel(
+        model = load_model(
             model="iic/SenseVoiceSmall",
             vad_model="fsmn-vad",
             vad_kwargs={"max_single_segment_time": 30000},
@@ -38,34 +48,23 @@ def quasi_streaming_recognition(audio_path, model=None, slice_duration=15, devic
             runtime="onnx",
         )
     
-    # 加载音频文件
-    speech, sample_rate = librosa.load(audio_path, sr=16000)
-    
-    # 计算每片的样本数
-    slice_samples = int(slice_duration * sample_rate)
+    sample_rate = 16000
     
-    # 分片处理音频
-    for i in range(0, len(speech), slice_samples):
-        # 提取音频片
-        start_idx = i
-        end_idx = min(i + slice_samples, len(speech))
-        speech_slice = speech[start_idx:end_idx]
-        
+    # 边解码边分片处理音频，每batch_size片合并为一次generate调用
+    batch = []
+    for speech_slice in iter_audio_slices(audio_path, slice_duration, sample_rate):
         # 如果音频片太小，跳过
         if len(speech_slice) < sample_rate:  # 少于1秒的片段跳过
             continue
-            
-        # 使用SenseVoiceSmall模型进行识别
-        res = model.generate(
-            input=speech_slice,
-            language="auto",  # "zn", "en", "yue", "ja", "ko", "nospeech"
-            use_itn=True,
-            disable_pbar=True
-        )
         
-        # 输出识别结果
-        if res and res[0]["text"]:
-            yield rich_transcription_postprocess(res[0]["text"])
+        batch.append(speech_slice)
+        if len(batch) >= batch_size:
+            yield from _recognize_batch(model, batch)
+            batch = []
+    
+    # 输出剩余不足一批的音频片
+    if batch:
+        yield from _recognize_batch(model, batch)
 
 class ASRWorker(threading.Thread):
     """
@@ -73,76 +72,109 @@ class ASRWorker(threading.Thread):
     - 在后台持续运行，从队列中获取任务并处理。
     - 在初始化时加载一次模型，避免重复加载的开销。
     """
-    def __init__(self, queue: PriorityQueue, model_path="iic/SenseVoiceSmall", device="auto"):
+    def __init__(self, queue: PriorityQueue, model_path="iic/SenseVoiceSmall", device="auto",
+                 dispatcher: Optional[TaskDispatcher] = None, index: int = 0):
         super().__init__()
         self.queue = queue
+        self.dispatcher = dispatcher  # 多卡调度时由分发线程提供任务
+        self.index = index  # 工作者在分发线程中的编号
         self.model_path = model_path
         self.model = None
         self.stop_event = threading.Event()  # 用于优雅地停止线程
         self.daemon = True  # 设置为守护线程，主程序退出时线程也会退出
         self.device = device
+        self._status_executor: Optional[ThreadPoolExecutor] = None  # 异步写入任务状态的单线程执行器
 
     def run(self):
         """线程的主执行逻辑"""
-        logger.info(f"正在初始化ASR模型，设备: {self.device}...")
+        logger.info("正在初始化ASR模型，设备: %s...", self.device)
         # 加载FunASR模型
         if self.device == "auto":
             device = "cuda:0" if torch.cuda.is_available() else "cpu" # 自动检测设备，优先使用cuda:0
         else:
             device = self.device
-        logger.info(f"模型将加载到设备: {device}")
-        self.model = AutoModel(
+        logger.info("模型将加载到设备: %s", device)
+        self.model = load_model(
             model=self.model_path,
             vad_model="fsmn-vad",
             vad_kwargs={"max_single_segment_time": 30000},
             device=device,
             runtime="onnx", # 使用ONNX Runtime以获得更好的性能
         )
-        logger.info(f"ASR模型初始化完成，使用的设备: {device}。")
+        logger.info("ASR模型初始化完成，使用的设备: %s。", device)
 
-        # 循环，直到stop_event被设置
-        while not self.stop_event.is_set():
-            # 使用事件等待，避免CPU空转
-            # 设置超时避免在停止时长时间阻塞
-            if self.queue.wait_for_task(timeout=1.0):
-                # 有任务可用，尝试获取任务
-                task_id = self.queue.pop()
+        # 任务状态由单线程执行器按顺序写入数据库，推理线程不等待提交即可开始下一个任务
+        self._status_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"asr-status-{self.index}")
+        try:
+            # 循环，直到stop_event被设置
+            while not self.stop_event.is_set():
+                # 阻塞等待下一个任务，设置超时避免在停止时长时间阻塞
+                task_id = self._next_task(timeout=1.0)
                 if task_id:
-                    task = self.queue.get_task(task_id)
-                    # 确保task存在且audio_filepath不为空
-                    if task and task.audio_filepath:
-                        logger.info(f"正在处理任务 {task.id}...")
-                        try:
-                            # FunASR模型需要文件路径作为输入
-                            # 确保文件存在
-                            if not os.path.exists(task.audio_filepath):
-                                raise FileNotFoundError(f"音频文件未找到: {task.audio_filepath}")
+                    try:
+                        self._process_task(task_id)
+                    finally:
+                        if self.dispatcher is not None:
+                            self.dispatcher.done(self.index)
+                # 如果等待超时（1秒），循环会继续并检查stop_event
+        finally:
+            # 退出前等待已提交的状态全部写入
+            self._status_executor.shutdown(wait=True)
+
+    def _next_task(self, timeout: float) -> Optional[str]:
+        """获取下一个任务ID，有分发线程时从本地队列获取，否则直接从全局队列获取"""
+        if self.dispatcher is not None:
+            return self.dispatcher.take(self.index, timeout=timeout)
+        # 使用条件变量等待并出队，避免CPU空转
+        return self.queue.pop_blocking(timeout=timeout)
+
+    def _process_task(self, task_id: str):
+        """处理单个任务并更新其状态"""
+        task = self.queue.get_task(task_id)
+        # 确保task存在且audio_filepath不为空
+        if task and task.audio_filepath:
+            logger.info("正在处理任务 %s...", task.id)
+            try:
+                # FunASR模型需要文件路径作为输入
+                # 确保文件存在
+                if not os.path.exists(task.audio_filepath):
+                    raise FileNotFoundError(f"音频文件未找到: {task.audio_filepath}")
+
+                # 调用模型进行推理
+                res = self.model.generate(
+                    input=task.audio_filepath, # 直接使用文件路径
+                    cache={},
+                    language="zh",
+                    disable_pbar=True,
+                    batch_size_s=60,
+                    use_itn=True,
+                    merge_vad=True,
+                    merge_length_s=15,
+                    preset_spk_num=2
+                )
+
+                # 使用富文本后处理，将标签转换为emoji格式
+                processed_text = rich_transcription_postprocess(res[0]["text"])
+                # 推理成功，更新任务状态和结果
+                self._submit_status(task.id, TaskStatus.COMPLETED, processed_text)
+                logger.info("任务 %s 已完成。", task.id)
+            except Exception as e:
+                # 推理失败，记录错误信息
+                logger.error("处理任务 %s 时出错: %s", task.id, e)
+                self._submit_status(task.id, TaskStatus.FAILED, str(e))
+        else:
+            logger.warning("任务 %s 未找到或无音频文件路径。", task_id)
 
-                            # 调用模型进行推理
-                            res = self.model.generate(
-                                input=task.audio_filepath, # 直接使用文件路径
-                                cache={},
-                                language="zh",
-                                disable_pbar=True,
-                                batch_size_s=60,
-                                use_itn=True,
-                                merge_vad=True,
-                                merge_length_s=15,
-                                preset_spk_num=2
-                            )
+    def _submit_status(self, task_id: str, status: TaskStatus, result: Optional[str]):
+        """记录状态变化的时间并提交到状态执行器，处理时间仍以推理结束的时刻计算"""
+        self._status_executor.submit(self._write_status, task_id, status, result, time.time())
 
-                            # 使用富文本后处理，将标签转换为emoji格式
-                            processed_text = rich_transcription_postprocess(res[0]["text"])
-                            # 推理成功，更新任务状态和结果
-                            self.queue.update_task_status(task.id, TaskStatus.COMPLETED, processed_text)
-                            logger.info(f"任务 {task.id} 已完成。")
-                        except Exception as e:
-                            # 推理失败，记录错误信息
-                            logger.error(f"处理任务 {task.id} 时出错: {e}")
-                            self.queue.update_task_status(task.id, TaskStatus.FAILED, str(e))
-                    else:
-                        logger.warning(f"任务 {task_id} 未找到或无音频文件路径。")
-            # 如果等待超时（1秒），循环会继续并检查stop_event
+    def _write_status(self, task_id: str, status: TaskStatus, result: Optional[str], finished_at: float):
+        """在状态执行器中写入任务状态，失败时只记录日志"""
+        try:
+            self.queue.update_task_status(task_id, status, result, finished_at)
+        except Exception as e:
+            logger.error("写入任务 %s 的状态时出错: %s", task_id, e)
 
 
     def quasi_streaming_process(self, audio_path, slice_duration=15):
@@ -172,5 +204,6 @@ class ASRWorker(threading.Thread):
         """设置事件，通知线程停止"""
         self.stop_event.set()
         # 唤醒可能在等待任务的线程，使其能够快速检查停止条件
-        if hasattr(self.queue, '_task_available'):
-            self.queue._task_available.set()
\ No newline at end of file
+        if self.dispatcher is not None:
+            self.dispatcher.wake(self.index)
+        self.queue.wake_waiters()
\ No newline at end of file
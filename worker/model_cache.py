@@ -0,0 +1,33 @@
+import threading
+from typing import Dict
+from funasr import AutoModel
+from uvicorn.server import logger
+
+# 已加载的模型实例，按加载参数缓存，工作者重启或多个调用方可直接复用
+_MODEL_CACHE: Dict[str, AutoModel] = {}
+_MODEL_LOCKS: Dict[str, threading.Lock] = {}
+_LOCK = threading.Lock()
+
+
+def load_model(**kwargs) -> AutoModel:
+    """
+    获取已加载的AutoModel，相同参数只加载一次。
+    - 参数(model、device、runtime、vad_model等)完全相同的调用共享同一个实例。
+    - 每组参数各自加锁，不同设备上的模型可以并行加载。
+
+    Args:
+        **kwargs: 传给AutoModel的参数
+
+    Returns:
+        AutoModel: 模型实例
+    """
+    key = repr(sorted(kwargs.items()))
+    with _LOCK:
+        lock = _MODEL_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        model = _MODEL_CACHE.get(key)
+        if model is None:
+            model = _MODEL_CACHE[key] = AutoModel(**kwargs)
+        else:
+            logger.info("复用已加载的模型: %s (%s)", kwargs.get("model"), kwargs.get("device"))
+        return model